@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Per-stage latency benchmark for the face verification engine.
+
+Measures cold import and model load, decode, face detection, resize/preprocess, model
+inference across a batch-size sweep, similarity and end-to-end verify_faces.
+With the Keras backend it also compares model.predict against the compiled
+forward pass, splitting per-call overhead from compute.
+Inputs are locally generated synthetic JPEGs at typical phone resolutions plus
+copies of real uploads, and verify_faces is timed on the uploads' gov-id/selfie
+pairs. Everything the engine writes (caches, digests, derivatives) goes to a
+temporary directory, never next to the uploads. Results are written as JSON so
+that runs can be diffed.
+
+Usage:
+    python benchmark_face_verification.py [--output bench.json] [--runs 20] [--batch-sizes 1,2,4,8,16] [--xla]
+                                          [--uploads-dir DIR] [--pairs 4]
+    python benchmark_face_verification.py --compare baseline.json bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import itertools
+import resource
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOADS_DIR = os.path.join(BACKEND_DIR, 'uploads', 'face-verification')
+SYNTHETIC_SIZES = ((640, 480), (1600, 900), (4032, 3024))
+
+
+def summarize(samples, items_per_sample=1):
+    """p50/p95/p99/mean latency in ms and throughput in items/s"""
+    samples = np.asarray(samples, dtype=np.float64)
+    return {
+        "runs": int(len(samples)),
+        "p50_ms": float(np.percentile(samples, 50) * 1000),
+        "p95_ms": float(np.percentile(samples, 95) * 1000),
+        "p99_ms": float(np.percentile(samples, 99) * 1000),
+        "mean_ms": float(samples.mean() * 1000),
+        "throughput_per_s": float(items_per_sample * len(samples) / samples.sum()) if samples.sum() > 0 else 0.0
+    }
+
+
+def time_runs(fn, runs, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def cold_start():
+    """Import and model-load time, measured in fresh interpreters"""
+    probe = (
+        "import time, json; t0 = time.perf_counter(); "
+        "import face_verification_consistent as f; t1 = time.perf_counter(); "
+        "f.FaceVerificationSystem(); t2 = time.perf_counter(); "
+        "print(json.dumps({'import_s': t1 - t0, 'model_load_s': t2 - t1}))"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', probe], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def synthetic_images(directory):
+    """Noise-textured JPEGs at typical upload resolutions"""
+    import cv2
+    rng = np.random.default_rng(0)
+    paths = []
+    for width, height in SYNTHETIC_SIZES:
+        # Low-frequency noise compresses like a photo rather than pure noise
+        small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        path = os.path.join(directory, f"synthetic-{width}x{height}.jpg")
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+
+def copy_pairs(uploads_dir, directory, max_pairs):
+    """Copy the latest gov-id/selfie pair of up to max_pairs users into directory.
+
+    The engine writes digests and derivatives next to the files it reads, so the
+    benchmark works on copies rather than the uploads themselves.
+    """
+    from bulk_reverify import discover_pairs
+    if not os.path.isdir(uploads_dir):
+        return []
+    pairs = []
+    for user_id, gov_id, selfie in discover_pairs(uploads_dir)[:max_pairs]:
+        user_dir = os.path.join(directory, user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        pairs.append(tuple(shutil.copy2(path, user_dir) for path in (gov_id, selfie)))
+    return pairs
+
+
+def predict_paths(model, runs, include_xla=False):
+    """Batch-of-one latency of model.predict vs the compiled forward pass.
+
+    Each path is also timed on a probe model that only pools its input, which
+    costs next to nothing to compute; its latency is the per-call overhead, and
+    the remainder on the real model is compute.
+    """
+    import tensorflow as tf
+    from inference_backends import KerasBackend
+
+    shape = tuple(model.input_shape[1:])
+    inputs = tf.keras.Input(shape)
+    probe = tf.keras.Model(inputs, tf.keras.layers.GlobalAveragePooling2D()(inputs))
+    img = np.zeros((1,) + shape, dtype=np.float32)
+
+    paths = {"predict": {"compiled": False}, "compiled": {"compiled": True}}
+    if include_xla:
+        paths["compiled_xla"] = {"compiled": True, "jit_compile": True}
+
+    results = {}
+    for name, options in paths.items():
+        timings = {}
+        for label, target in (("total", model), ("overhead", probe)):
+            backend = KerasBackend(target, 'benchmark', warmup_batch_sizes=(1,), **options)
+            timings[label] = summarize(time_runs(lambda: backend.predict(img), runs, warmup=3))
+        timings["compute_p50_ms"] = timings["total"]["p50_ms"] - timings["overhead"]["p50_ms"]
+        results[name] = timings
+    return results
+
+
+def run_benchmarks(runs, batch_sizes, include_cold_start=True, include_xla=False, uploads_dir=UPLOADS_DIR,
+                   max_pairs=4):
+    results = {
+        "host": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count()
+        }
+    }
+    if include_cold_start:
+        results["cold_start"] = cold_start()
+
+    import cv2
+    import face_verification_consistent as engine
+    from embedding_cache import EmbeddingCache
+    import face_derivatives
+    from image_quality import locate_face
+
+    load_start = time.perf_counter()
+    # A zero-size cache and no perceptual-hash reuse keep every call on the full path
+    verifier = engine.FaceVerificationSystem(
+        cache=EmbeddingCache('benchmark', max_entries=0), screen=False, phash_index=False
+    )
+    results["model_load_in_process_s"] = time.perf_counter() - load_start
+    results["backend"] = verifier.backend.name
+    results["model_version"] = verifier.model_version
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pairs = copy_pairs(uploads_dir, os.path.join(tmp, 'uploads'), max_pairs)
+        images = synthetic_images(tmp) + [path for pair in pairs for path in pair]
+        results["upload_pairs"] = len(pairs)
+        stages = {}
+        width, height = verifier.target_size
+        out = np.empty((height, width, 3), dtype=np.float32)
+
+        for path in images:
+            with open(path, 'rb') as f:
+                img_bytes = f.read()
+            decoded = engine.decode_image(img_bytes)
+            # What a stored derivative costs to load instead (see face_derivatives.py)
+            derivative = cv2.imencode(
+                '.webp', cv2.resize(decoded, verifier.target_size), face_derivatives.ENCODE_PARAMS
+            )[1]
+            name = os.path.basename(path)
+            stages[name] = {
+                "size": [int(decoded.shape[1]), int(decoded.shape[0])],
+                "bytes": len(img_bytes),
+                "decode": summarize(time_runs(lambda: engine.decode_image(img_bytes), runs)),
+                "derivative_bytes": int(derivative.size),
+                "derivative_decode": summarize(
+                    time_runs(lambda: cv2.imdecode(derivative, cv2.IMREAD_COLOR), runs)
+                ),
+                "locate_face": summarize(time_runs(lambda: locate_face(decoded), runs)),
+                "resize_preprocess": summarize(
+                    time_runs(lambda: engine.resize_into(decoded, out, verifier.target_size), runs)
+                )
+            }
+        results["per_image"] = stages
+
+        batch = np.concatenate([
+            engine.load_and_preprocess_image(path, verifier.target_size, crop_faces=verifier.crop_faces)
+            for path in images
+        ])
+        sweep = {}
+        for batch_size in batch_sizes:
+            inputs = np.resize(batch, (batch_size,) + batch.shape[1:]).astype(np.float32)
+            sweep[str(batch_size)] = summarize(
+                time_runs(lambda: verifier.backend.predict(inputs), max(3, runs // batch_size)),
+                items_per_sample=batch_size
+            )
+        results["predict"] = sweep
+
+        if verifier.backend.name == 'keras':
+            results["predict_paths"] = predict_paths(verifier.model, runs, include_xla)
+
+        embeddings = verifier.extract_face_embeddings(batch[:2])
+        results["similarity"] = summarize(
+            time_runs(lambda: verifier.calculate_similarity(embeddings[0], embeddings[1]), runs * 10)
+        )
+
+        # Bytes rather than paths, so stored derivatives do not shortcut the decode;
+        # synthetic images stand in only when there are no uploads
+        inputs = []
+        for pair in pairs or [tuple(images[-2:])]:
+            pair_bytes = []
+            for path in pair:
+                with open(path, 'rb') as f:
+                    pair_bytes.append(f.read())
+            inputs.append(pair_bytes)
+        next_pair = itertools.cycle(inputs).__next__
+        results["verify_faces"] = summarize(time_runs(lambda: verifier.verify_faces(*next_pair()), runs))
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def flatten(results, prefix=''):
+    """Flatten nested results into {'a.b.p50_ms': value} for diffing"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline_path, current_path):
+    """Print the relative change of every latency/throughput/RSS metric"""
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f))
+    with open(current_path) as f:
+        current = flatten(json.load(f))
+
+    metric_suffixes = ('_ms', '_s', 'throughput_per_s', 'peak_rss_mb')
+    for name in sorted(set(baseline) & set(current)):
+        if not name.endswith(metric_suffixes) or baseline[name] == 0:
+            continue
+        change = (current[name] - baseline[name]) / baseline[name] * 100
+        print(f"{name:60s} {baseline[name]:12.3f} -> {current[name]:12.3f}  ({change:+.1f}%)")
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Face verification per-stage benchmark")
+    parser.add_argument('--output', default=None, help="Write results JSON here")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16')
+    parser.add_argument('--skip-cold-start', action='store_true')
+    parser.add_argument('--xla', action='store_true', help="Also time the XLA-compiled forward pass")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    parser.add_argument('--uploads-dir', default=UPLOADS_DIR,
+                        help="Upload tree (<user>/gov-id-*.jpg, selfie-*.jpg) to benchmark; it is copied, never written")
+    parser.add_argument('--pairs', type=int, default=4, help="Users whose latest gov-id/selfie pair is benchmarked")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',') if size]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # The engine reads this at import, here and in the cold-start interpreter
+        os.environ['FACE_EMBEDDING_CACHE_DIR'] = cache_dir
+        results = run_benchmarks(
+            args.runs, batch_sizes, include_cold_start=not args.skip_cold_start, include_xla=args.xla,
+            uploads_dir=args.uploads_dir, max_pairs=args.pairs
+        )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Build the frozen face embedding model artifact.
+
+Builds InceptionResNetV2 with the seeded embedding head once and saves it,
+together with a manifest, under model_artifacts/. FaceVerificationSystem loads
+this artifact at startup so every process and host produces identical
+embeddings, and the embedding cache can key on the manifest version.
+
+With --tflite, the artifact is also converted to TFLite for the quantized
+CPU backend. int8 calibration uses a representative dataset drawn from the
+local uploads/face-verification/ images.
+
+Usage: python build_face_model.py [--output-dir DIR] [--force] [--tflite dynamic,float16,int8]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import tensorflow as tf
+from face_verification_consistent import (
+    build_model,
+    load_artifact,
+    artifact_paths,
+    tflite_artifact_path,
+    load_and_preprocess_image,
+    CROP_FACES,
+    MODEL_ARTIFACT_DIR,
+    MODEL_ARTIFACT_VERSION,
+    EMBEDDING_HEAD_SEED
+)
+from inference_backends import convert_to_tflite, QUANTIZATION_MODES
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'face-verification')
+
+
+def weights_digest(model):
+    """SHA-256 over every weight tensor, in layer order"""
+    digest = hashlib.sha256()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()
+
+
+def representative_images(images_dir=UPLOADS_DIR, limit=100):
+    """Callable yielding preprocessed local images for int8 calibration"""
+    paths = sorted(glob.glob(os.path.join(images_dir, '**', '*.jpg'), recursive=True))[:limit]
+    if not paths:
+        raise ValueError(f"No representative images found under {images_dir}")
+
+    def batches():
+        for img_path in paths:
+            try:
+                yield load_and_preprocess_image(img_path, crop_faces=CROP_FACES).astype(np.float32)
+            except ValueError as e:
+                print(f"Warning: skipping representative image {img_path}: {e}", file=sys.stderr)
+
+    return batches
+
+
+def build_keras_artifact(output_dir, force=False):
+    """Build and save the Keras artifact and manifest; returns the model"""
+    model_path, manifest_path = artifact_paths(output_dir, MODEL_ARTIFACT_VERSION)
+    if os.path.exists(model_path) and os.path.exists(manifest_path) and not force:
+        print(f"Model artifact already exists: {model_path}")
+        model, _ = load_artifact(output_dir, MODEL_ARTIFACT_VERSION)
+        return model
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.time()
+    model = build_model()
+    digest = weights_digest(model)
+
+    # Write to a temporary name so a half-written artifact is never loaded
+    tmp_path = model_path + '.tmp.keras'
+    model.save(tmp_path)
+    os.replace(tmp_path, model_path)
+
+    manifest = {
+        "version": f"face_embedding_v{MODEL_ARTIFACT_VERSION}-{digest[:12]}",
+        "artifact_version": MODEL_ARTIFACT_VERSION,
+        "architecture": "InceptionResNetV2+GlobalAveragePooling2D+Dense(128, relu)",
+        "input_shape": [299, 299, 3],
+        "embedding_dim": int(model.output_shape[-1]),
+        "head_seed": EMBEDDING_HEAD_SEED,
+        "weights_sha256": digest,
+        "tensorflow_version": tf.__version__,
+        "built_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Saved {model_path} ({manifest['version']}) in {time.time() - start:.1f}s", file=sys.stderr)
+    return model
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Build the frozen face embedding model artifact")
+    parser.add_argument('--output-dir', default=MODEL_ARTIFACT_DIR)
+    parser.add_argument('--force', action='store_true', help="Rebuild even if the artifact exists")
+    parser.add_argument('--tflite', default='',
+                        help=f"Comma-separated TFLite quantization modes to build ({', '.join(QUANTIZATION_MODES)})")
+    parser.add_argument('--representative-dir', default=UPLOADS_DIR,
+                        help="Images used to calibrate int8 quantization")
+    args = parser.parse_args()
+
+    model = build_keras_artifact(args.output_dir, args.force)
+
+    for quantization in [mode.strip() for mode in args.tflite.split(',') if mode.strip()]:
+        tflite_path = tflite_artifact_path(quantization, args.output_dir, MODEL_ARTIFACT_VERSION)
+        if os.path.exists(tflite_path) and not args.force:
+            print(f"TFLite model already exists: {tflite_path}")
+            continue
+        start = time.time()
+        representative = representative_images(args.representative_dir) if quantization == 'int8' else None
+        convert_to_tflite(model, tflite_path, quantization, representative)
+        size_mb = os.path.getsize(tflite_path) / (1024 * 1024)
+        print(f"Saved {tflite_path} ({size_mb:.1f} MB) in {time.time() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Bulk re-verification over uploads/face-verification/.
+
+Discovers gov-id/selfie pairs for every user, streams them through a process
+pool in batches (one model.predict per batch) and appends one JSON line per
+pair to the output file. Re-running with the same output resumes where an
+interrupted run stopped.
+
+With --preprocess-workers, a single process scores the pairs instead and
+decodes upcoming batches on a thread pool while the current one is in
+inference (see preprocess_pipeline.py).
+
+Usage: python bulk_reverify.py [--output results.jsonl] [--workers 2] [--batch-size 16]
+                               [--all-pairs] [--threshold 0.7]
+                               [--preprocess-workers 2 --prefetch-depth 2]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from contextlib import ExitStack
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'face-verification')
+
+_verifier = None
+
+
+def discover_pairs(uploads_dir, all_pairs=False):
+    """(user_id, gov_id_path, selfie_path) for each user, newest upload first.
+
+    By default only the latest gov-id and selfie are paired, which matches what
+    processFaceVerification scores; all_pairs scores every gov-id against every selfie.
+    """
+    pairs = []
+    for user_id in sorted(os.listdir(uploads_dir)):
+        user_path = os.path.join(uploads_dir, user_id)
+        if not os.path.isdir(user_path):
+            continue
+        images = sorted(os.listdir(user_path), reverse=True)
+        gov_ids = [os.path.join(user_path, img) for img in images if img.startswith('gov-id')]
+        selfies = [os.path.join(user_path, img) for img in images if img.startswith('selfie')]
+        if not gov_ids or not selfies:
+            continue
+        if not all_pairs:
+            gov_ids, selfies = gov_ids[:1], selfies[:1]
+        pairs.extend((user_id, gov_id, selfie) for gov_id in gov_ids for selfie in selfies)
+    return pairs
+
+
+def load_checkpoint(output_path):
+    """(gov_id, selfie, model_version, threshold) of records already written to output_path.
+
+    Drops a trailing partial line from a crash. Failed records do not count, so a
+    re-run retries them. Records scored under another model version or threshold
+    do not count either, so a re-run after either changes rescores them.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            f.truncate(complete)
+
+    for line in data[:complete].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not record.get('success'):
+            continue
+        done.add((record['gov_id'], record['selfie'], record.get('model_version'), record.get('threshold')))
+    return done
+
+
+def _current_model_version():
+    """model_version the workers will record, loading the model only when the artifact cannot tell"""
+    from face_verification_consistent import configured_model_version
+    model_version = configured_model_version()
+    if model_version is None:
+        _init_worker()
+        model_version = _verifier.model_version
+    return model_version
+
+
+def _init_worker():
+    global _verifier
+    from face_verification_consistent import FaceVerificationSystem
+    _verifier = FaceVerificationSystem()
+
+
+def _score_batch(task):
+    batch, threshold = task
+    result = _verifier.verify_faces_batch([(gov_id, selfie) for _, gov_id, selfie in batch], threshold)
+    return _batch_records(batch, result, threshold)
+
+
+def _stream_records(pending, batch_size, threshold, workers, prefetch):
+    """Score pending in this process, yielding each batch's records as it completes"""
+    global _verifier
+    from face_verification_consistent import FaceVerificationSystem
+    from preprocess_pipeline import PreprocessPipeline
+    _verifier = FaceVerificationSystem(pipeline=PreprocessPipeline(workers, prefetch))
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    results = _verifier.verify_faces_stream(
+        [(gov_id, selfie) for _, gov_id, selfie in pending], batch_size, threshold
+    )
+    for batch, result in zip(batches, results):
+        yield _batch_records(batch, result, threshold)
+
+
+def _batch_records(batch, result, threshold):
+    records = []
+    for i, (user_id, gov_id, selfie) in enumerate(batch):
+        pair_result = result['results'][i] if result['success'] else result
+        records.append({
+            "user_id": user_id,
+            "gov_id": gov_id,
+            "selfie": selfie,
+            "success": bool(pair_result.get('success')),
+            "match_score": pair_result.get('match_score', 0.0),
+            "is_verified": pair_result.get('is_verified', False),
+            "threshold": threshold,
+            "model_version": _verifier.model_version,
+            "error": pair_result.get('error')
+        })
+    return records
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Re-score every stored face verification pair")
+    parser.add_argument('--uploads-dir', default=UPLOADS_DIR)
+    parser.add_argument('--output', default='reverify_results.jsonl')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=16, help="Pairs per model.predict")
+    parser.add_argument('--all-pairs', action='store_true', help="Score every gov-id against every selfie")
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--preprocess-workers', type=int, default=0,
+                        help="Score in one process, decoding upcoming batches on this many threads")
+    parser.add_argument('--prefetch-depth', type=int, default=2, help="Batches decoded ahead of inference")
+    args = parser.parse_args()
+    if args.preprocess_workers > 0 and args.workers > 1:
+        parser.error("--preprocess-workers scores in one process and cannot be combined with --workers")
+
+    if not os.path.exists(args.uploads_dir):
+        print(json.dumps({"success": False, "error": "Uploads directory not found"}))
+        sys.exit(1)
+
+    pairs = discover_pairs(args.uploads_dir, args.all_pairs)
+    done = load_checkpoint(args.output)
+    model_version = _current_model_version() if pairs else None
+    pending = [pair for pair in pairs if (pair[1], pair[2], model_version, args.threshold) not in done]
+    print(f"{len(pairs)} pairs found, {len(pairs) - len(pending)} already scored under {model_version}, "
+          f"{len(pending)} to go", file=sys.stderr)
+
+    tasks = [
+        (pending[i:i + args.batch_size], args.threshold)
+        for i in range(0, len(pending), args.batch_size)
+    ]
+
+    start = time.time()
+    scored = 0
+    verified = 0
+    with ExitStack() as stack:
+        out = stack.enter_context(open(args.output, 'a'))
+        if not pending:
+            batches = []
+        elif args.preprocess_workers > 0:
+            batches = _stream_records(
+                pending, args.batch_size, args.threshold, args.preprocess_workers, args.prefetch_depth
+            )
+        else:
+            # spawn, not fork: TensorFlow's runtime does not survive fork()
+            context = multiprocessing.get_context('spawn')
+            pool = stack.enter_context(context.Pool(args.workers, initializer=_init_worker))
+            batches = pool.imap_unordered(_score_batch, tasks)
+        for records in batches:
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+            scored += len(records)
+            verified += sum(record['is_verified'] for record in records)
+            elapsed = time.time() - start
+            print(f"{scored}/{len(pending)} pairs, {scored / elapsed:.2f} pairs/s, {verified} verified",
+                  file=sys.stderr)
+
+    print(json.dumps({
+        "success": True,
+        "pairs_scored": scored,
+        "pairs_verified": verified,
+        "pairs_total": len(pairs),
+        "elapsed": round(time.time() - start, 3),
+        "output": args.output
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ const User = require('../models/user.model');
 const path = require('path');
 const fs = require('fs');
 const { v4: uuidv4 } = require('uuid');
-const { verifyFacesWithPythonBase64 } = require('../utils/pythonFaceVerification');
+const { verifyFacesWithPythonServer } = require('../utils/pythonFaceVerification');
 
 // Simulate face comparison for fallback
 const simulateFaceComparison = async () => {
@@ -231,15 +231,33 @@ const processFaceVerification = async (req, res) => {
             return res.status(400).json({ success: false, message: 'Image files not found on server' });
         }
         
-        const govIdBuffer = fs.readFileSync(governmentIdImage);
-        const selfieBuffer = fs.readFileSync(selfieImage);
-        
         // Perform face comparison using Python with TensorFlow
         let comparisonResult;
+        // Only a real Python result can be degraded; the simulated fallback never is
+        let degraded = false;
+        let tier = null;
         try {
             console.log('🔄 Starting Python face verification...');
-            comparisonResult = await verifyFacesWithPythonBase64(govIdBuffer, selfieBuffer);
-            
+            comparisonResult = await verifyFacesWithPythonServer(governmentIdImage, selfieImage);
+
+            // Unusable upload (too dark, blurry, no face): ask for a new photo instead of falling back
+            if (comparisonResult.rejected) {
+                return res.status(422).json({
+                    success: false,
+                    message: `Face verification rejected: ${comparisonResult.error}`,
+                    data: { rejection: comparisonResult.rejection }
+                });
+            }
+
+            // Server is too busy to answer within the deadline: let the client retry rather than guess
+            if (comparisonResult.deadline_exceeded) {
+                return res.status(503).json({
+                    success: false,
+                    message: 'Face verification is busy, please retry shortly',
+                    data: { estimatedMs: comparisonResult.estimated_ms }
+                });
+            }
+
             if (!comparisonResult.success) {
                 throw new Error(comparisonResult.error || 'Python verification failed');
             }
@@ -253,6 +271,12 @@ const processFaceVerification = async (req, res) => {
             }
             
             console.log(`✅ Python verification completed. Match score: ${(comparisonResult.matchScore * 100).toFixed(2)}%`);
+
+            degraded = Boolean(comparisonResult.degraded);
+            tier = comparisonResult.tier || 'full';
+            if (degraded) {
+                console.warn(`⚠️ Face verification served by the ${tier} model tier to meet its deadline`);
+            }
         } catch (comparisonError) {
             console.error('❌ Python face verification failed:', comparisonError);
             console.error('Error stack:', comparisonError.stack);
@@ -266,6 +290,7 @@ const processFaceVerification = async (req, res) => {
         // Update user verification status
         user.faceVerification.status = isVerified ? 'verified' : 'rejected';
         user.faceVerification.matchScore = matchScore;
+        user.faceVerification.degraded = degraded;
         user.faceVerification.verifiedAt = new Date();
         
         await user.save();
@@ -277,6 +302,8 @@ const processFaceVerification = async (req, res) => {
                 userId: user._id,
                 isVerified,
                 matchScore,
+                degraded,
+                tier,
                 verificationId
             }
         });
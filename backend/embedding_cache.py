@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for face embeddings.
+
+Embeddings are keyed by a hash of the raw image bytes and the model version,
+so an image that was already embedded by the same model never goes through
+the network again. A bounded in-memory LRU sits in front of an optional
+on-disk layer of .npy files. Embeddings precomputed for an upload (see
+embedding_precompute.py) live in a sidecar directory next to the image.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SIDECAR_DIR = '.embeddings'
+
+
+class EmbeddingCache:
+    def __init__(self, model_version, max_entries=512, cache_dir=None):
+        """Create a cache; cache_dir=None keeps embeddings in memory only"""
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.sidecar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def content_digest(img_bytes):
+        """Hash of the image bytes alone, which can be stored and reused across model versions"""
+        return hashlib.sha256(img_bytes).hexdigest()
+
+    def key_for_digest(self, content_digest):
+        """Cache key for an image with this content_digest, scoped to the model version"""
+        digest = hashlib.sha256()
+        digest.update(self.model_version.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(content_digest.encode('ascii'))
+        return digest.hexdigest()
+
+    def key(self, img_bytes):
+        """Content hash of the image bytes, scoped to the model version"""
+        return self.key_for_digest(self.content_digest(img_bytes))
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def sidecar_path(self, img_path, key):
+        """Where the precomputed embedding for the image at img_path is stored"""
+        return os.path.join(os.path.dirname(os.path.abspath(img_path)), SIDECAR_DIR, f"{key}.npy")
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, embedding):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embedding, allow_pickle=False)
+        os.replace(tmp_path, path)
+
+    def _remember(self, key, embedding):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, img_path=None):
+        """Return the cached embedding for key, or None on a miss.
+
+        img_path, when the image came from a file, also checks its sidecar.
+        """
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+
+        if self.cache_dir:
+            embedding = self._read(self._disk_path(key))
+            if embedding is not None:
+                with self._lock:
+                    self._remember(key, embedding)
+                    self.disk_hits += 1
+                return embedding
+
+        if img_path is not None:
+            embedding = self._read(self.sidecar_path(img_path, key))
+            if embedding is not None:
+                with self._lock:
+                    self._remember(key, embedding)
+                    self.sidecar_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, embedding):
+        """Store an embedding in memory and, when configured, on disk"""
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, embedding)
+
+        if self.cache_dir:
+            self._write(self._disk_path(key), embedding)
+            with self._lock:
+                self.writes += 1
+
+    def has_sidecar(self, img_path, key):
+        return os.path.exists(self.sidecar_path(img_path, key))
+
+    def put_sidecar(self, img_path, key, embedding):
+        """Store a precomputed embedding next to the image it belongs to"""
+        self._write(self.sidecar_path(img_path, key), np.asarray(embedding, dtype=np.float32))
+
+    def stats(self):
+        """Hit/miss/eviction counters"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits + self.sidecar_hits
+            lookups = hits + self.misses
+            return {
+                "model_version": self.model_version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "sidecar_hits": self.sidecar_hits,
+                "hits": hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_writes": self.writes,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
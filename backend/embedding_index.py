@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+1:N duplicate-identity search over enrolled face embeddings.
+
+Embeddings are L2-normalised and kept in one contiguous memory-mapped matrix
+(float32 or float16) with an id map, so a top-k cosine search is a single
+matrix-vector product. Removal swaps the last row into the freed slot, which
+keeps the live rows dense. The id map, row count and settings live in one
+manifest, meta.json, which flush replaces after the vectors are on disk, so
+a crash never pairs an id map with a vector file of another length. The index records the model version of its
+embeddings and refuses vectors or queries from any other version, because
+scores across versions are meaningless.
+
+Usage:
+    python embedding_index.py add <index_dir> <user_id> <image_path>
+    python embedding_index.py remove <index_dir> <user_id>
+    python embedding_index.py search <index_dir> <image_path> [--k 5] [--threshold 0.7]
+    python embedding_index.py stats <index_dir>
+"""
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+FLOAT16_CHUNK_ROWS = 4096
+
+
+class EmbeddingIndex:
+    def __init__(self, index_dir, dim=None, dtype=None, initial_capacity=1024, model_version=None, create=True):
+        """Open the index in index_dir, creating it if it does not exist and create is set.
+
+        dim and dtype default to 128 and float32 for a new index. For an existing
+        index they, like model_version, must match what it was built with.
+        """
+        self.index_dir = index_dir
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if not create and not os.path.exists(meta_path):
+            raise ValueError(f"No embedding index in {index_dir}")
+        os.makedirs(index_dir, exist_ok=True)
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.dtype = np.dtype(meta['dtype'])
+            self.count = meta['count']
+            self.model_version = meta.get('model_version')
+            if dim is not None and dim != self.dim:
+                raise ValueError(f"Index holds {self.dim}-d embeddings, not {dim}-d")
+            if dtype is not None and np.dtype(dtype) != self.dtype:
+                raise ValueError(f"Index stores {self.dtype.name} vectors, not {dtype}; rebuild it to change the dtype")
+            if 'ids' in meta:
+                self.ids = meta['ids']
+            else:
+                # Indexes written before the manifest kept the id map in its own file
+                with open(os.path.join(index_dir, 'ids.json')) as f:
+                    self.ids = json.load(f)[:self.count]
+            self.vectors = np.load(self._vectors_path(), mmap_mode='r+')
+        else:
+            dtype = dtype or 'float32'
+            if dtype not in ('float32', 'float16'):
+                raise ValueError(f"Unsupported index dtype: {dtype}")
+            self.dim = dim or 128
+            self.dtype = np.dtype(dtype)
+            self.count = 0
+            self.model_version = model_version
+            self.ids = []
+            self.vectors = np.lib.format.open_memmap(
+                self._vectors_path(), mode='w+', dtype=self.dtype, shape=(initial_capacity, self.dim)
+            )
+            self.flush()
+
+        self.rows = {item_id: row for row, item_id in enumerate(self.ids)}
+        self._check_version(model_version)
+
+    def _vectors_path(self):
+        return os.path.join(self.index_dir, 'vectors.npy')
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, item_id):
+        return item_id in self.rows
+
+    def _check_version(self, model_version):
+        """Reject embeddings from another model version; an empty unversioned index adopts it"""
+        if model_version is None or model_version == self.model_version:
+            return
+        if self.model_version is None and self.count == 0:
+            self.model_version = model_version
+            return
+        raise ValueError(
+            f"Index holds embeddings from model version {self.model_version or 'unknown'}, not {model_version}; "
+            "rebuild it with the current model"
+        )
+
+    def _normalize(self, embedding):
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if embedding.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-d embedding, got {embedding.shape[0]}")
+        norm = np.linalg.norm(embedding)
+        if norm == 0 or np.isnan(norm):
+            raise ValueError("Cannot index a zero or NaN embedding")
+        return embedding / norm
+
+    def _grow(self):
+        """Double the capacity of the memory-mapped matrix"""
+        capacity = max(1, len(self.vectors)) * 2
+        tmp_path = self._vectors_path() + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype, shape=(capacity, self.dim))
+        grown[:self.count] = self.vectors[:self.count]
+        grown.flush()
+        del grown
+        self.vectors.flush()
+        self.vectors = None
+        os.replace(tmp_path, self._vectors_path())
+        self.vectors = np.load(self._vectors_path(), mmap_mode='r+')
+
+    def add(self, item_id, embedding, model_version=None):
+        """Add or replace the embedding for item_id, made by model_version if given"""
+        self._check_version(model_version)
+        vector = self._normalize(embedding)
+        row = self.rows.get(item_id)
+        if row is None:
+            if self.count == len(self.vectors):
+                self._grow()
+            row = self.count
+            self.count += 1
+            self.ids.append(item_id)
+            self.rows[item_id] = row
+        self.vectors[row] = vector
+
+    def remove(self, item_id):
+        """Remove item_id; returns False if it was not indexed"""
+        row = self.rows.pop(item_id, None)
+        if row is None:
+            return False
+        last = self.count - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self.vectors[row] = self.vectors[last]
+            self.ids[row] = moved_id
+            self.rows[moved_id] = row
+        self.ids.pop()
+        self.count -= 1
+        return True
+
+    def search(self, embedding, k=5, threshold=None, exclude=None, chunk_size=None, model_version=None):
+        """Top-k (item_id, cosine similarity) matches for a query made by model_version if given, best first.
+
+        chunk_size scans the matrix in row blocks. float16 indexes are always
+        scanned in blocks, each upcast to float32 because NumPy has no
+        half-precision BLAS.
+        """
+        if self.count == 0:
+            return []
+        self._check_version(model_version)
+        query = self._normalize(embedding)
+        live = self.vectors[:self.count]
+        if chunk_size is None and self.dtype == np.float16:
+            chunk_size = FLOAT16_CHUNK_ROWS
+
+        if chunk_size is None or chunk_size >= self.count:
+            scores = live.astype(np.float32, copy=False) @ query
+            candidates = np.arange(self.count)
+        else:
+            # Keep only the running top-(k + excluded) rows between blocks
+            keep = k + (len(exclude) if exclude else 0)
+            best_rows = np.empty(0, dtype=np.int64)
+            best_scores = np.empty(0, dtype=np.float32)
+            for start in range(0, self.count, chunk_size):
+                block = live[start:start + chunk_size].astype(np.float32, copy=False) @ query
+                merged_rows = np.concatenate([best_rows, np.arange(start, start + len(block))])
+                merged_scores = np.concatenate([best_scores, block])
+                if len(merged_scores) > keep:
+                    top = np.argpartition(-merged_scores, keep - 1)[:keep]
+                    merged_rows, merged_scores = merged_rows[top], merged_scores[top]
+                best_rows, best_scores = merged_rows, merged_scores
+            scores, candidates = best_scores, best_rows
+
+        limit = min(len(scores), k + (len(exclude) if exclude else 0))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+
+        matches = []
+        for i in top:
+            item_id = self.ids[candidates[i]]
+            score = float(scores[i])
+            if exclude and item_id in exclude:
+                continue
+            if threshold is not None and score < threshold:
+                break
+            matches.append((item_id, score))
+            if len(matches) == k:
+                break
+        return matches
+
+    def flush(self):
+        """Persist the vectors, then the manifest that makes them visible"""
+        self.vectors.flush()
+        path = os.path.join(self.index_dir, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "model_version": self.model_version,
+                "count": self.count,
+                "capacity": len(self.vectors),
+                "ids": self.ids
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        legacy_ids = os.path.join(self.index_dir, 'ids.json')
+        if os.path.exists(legacy_ids):
+            os.remove(legacy_ids)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "capacity": len(self.vectors),
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "model_version": self.model_version,
+            "bytes": int(self.vectors.nbytes)
+        }
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="1:N face embedding index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add')
+    add_parser.add_argument('index_dir')
+    add_parser.add_argument('user_id')
+    add_parser.add_argument('image_path')
+    add_parser.add_argument('--dtype', default=None, choices=['float32', 'float16'],
+                            help="Vector precision of a new index (default float32); an existing index keeps its own")
+
+    remove_parser = subparsers.add_parser('remove')
+    remove_parser.add_argument('index_dir')
+    remove_parser.add_argument('user_id')
+
+    search_parser = subparsers.add_parser('search')
+    search_parser.add_argument('index_dir')
+    search_parser.add_argument('image_path')
+    search_parser.add_argument('--k', type=int, default=5)
+    search_parser.add_argument('--threshold', type=float, default=None)
+    search_parser.add_argument('--chunk-size', type=int, default=None)
+
+    stats_parser = subparsers.add_parser('stats')
+    stats_parser.add_argument('index_dir')
+
+    args = parser.parse_args()
+
+    if args.command in ('add', 'search'):
+        from face_verification_consistent import FaceVerificationSystem
+        verifier = FaceVerificationSystem()
+        try:
+            embedding = verifier.get_face_embedding(args.image_path)
+        except ValueError as e:
+            print(json.dumps({"success": False, "error": str(e)}))
+            sys.exit(1)
+
+    try:
+        if args.command in ('add', 'search'):
+            index = EmbeddingIndex(
+                args.index_dir, dim=len(embedding), dtype=getattr(args, 'dtype', None),
+                model_version=verifier.model_version, create=args.command == 'add'
+            )
+        else:
+            index = EmbeddingIndex(args.index_dir, create=False)
+    except ValueError as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
+
+    if args.command == 'add':
+        index.add(args.user_id, embedding, verifier.model_version)
+        index.flush()
+        result = {"success": True, "count": len(index)}
+    elif args.command == 'remove':
+        removed = index.remove(args.user_id)
+        index.flush()
+        result = {"success": removed, "count": len(index)}
+    elif args.command == 'search':
+        matches = index.search(
+            embedding, k=args.k, threshold=args.threshold, chunk_size=args.chunk_size,
+            model_version=verifier.model_version
+        )
+        result = {
+            "success": True,
+            "matches": [{"user_id": item_id, "score": score} for item_id, score in matches]
+        }
+    else:
+        result = {"success": True, **index.stats()}
+
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Eager embedding precompute for new face verification uploads.
+
+Polls uploads/face-verification/ for new gov-id and selfie images, queues
+them on a bounded queue and embeds them in small batches as soon as they
+land. Each embedding is stored in a sidecar next to its image, keyed by the
+same version-scoped content hash as the embedding cache, so a later
+verification only loads two vectors and takes a dot product. The upload's
+model-ready derivative is stored at the same time.
+
+Usage: python embedding_precompute.py [--uploads-dir DIR] [--interval 1.0] [--queue-size 64]
+                                      [--batch-size 8] [--once]
+
+face_verification_server.py --precompute-uploads runs the same watcher
+inside the server, sharing its loaded model.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from contextlib import nullcontext
+
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'face-verification')
+IMAGE_PREFIXES = ('gov-id', 'selfie')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class UploadWatcher:
+    def __init__(self, verifier, uploads_dir=UPLOADS_DIR, queue_size=64, batch_size=8,
+                 interval=1.0, settle=1.0, lock=None):
+        """Watch uploads_dir and precompute embeddings with verifier.
+
+        Files are only picked up once they are settle seconds old, so uploads
+        still being written are left for a later scan. lock guards the model
+        when it is shared with a server.
+        """
+        self.verifier = verifier
+        self.uploads_dir = uploads_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self.settle = settle
+        self.lock = lock if lock is not None else nullcontext()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._dir_mtimes = {}
+        self._stop = threading.Event()
+        self.computed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def scan(self):
+        """Upload images in user directories that changed since the last scan.
+
+        A new upload moves its directory's mtime, so only one stat per user
+        directory is paid while nothing arrives. A changed directory's images
+        are returned once none of them is still settling; until then the
+        directory is left for a later scan. Images that already have sidecars
+        are skipped by process().
+        """
+        found = []
+        now = time.time()
+        try:
+            user_dirs = list(os.scandir(self.uploads_dir))
+        except FileNotFoundError:
+            return found
+        dir_mtimes = {}
+        for user_dir in user_dirs:
+            try:
+                if not user_dir.is_dir():
+                    continue
+                # Read before listing, so an upload landing mid-scan moves it again
+                mtime = user_dir.stat().st_mtime_ns
+                if self._dir_mtimes.get(user_dir.path) == mtime:
+                    dir_mtimes[user_dir.path] = mtime
+                    continue
+                images = []
+                for entry in os.scandir(user_dir.path):
+                    name = entry.name.lower()
+                    if not entry.is_file() or not name.startswith(IMAGE_PREFIXES) or not name.endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if now - entry.stat().st_mtime < self.settle:
+                        break
+                    images.append(entry.path)
+                else:
+                    dir_mtimes[user_dir.path] = mtime
+                    found.extend(images)
+            except FileNotFoundError:
+                continue
+        # Directories removed since the last scan drop out here
+        self._dir_mtimes = dir_mtimes
+        return found
+
+    def _next_batch(self, timeout):
+        """Up to batch_size queued paths, waiting at most timeout for the first one"""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def process(self, img_paths):
+        """Embed the images in img_paths that have no sidecar yet and write their sidecars"""
+        cache = self.verifier.cache
+        pending = {}
+        for img_path in img_paths:
+            try:
+                with open(img_path, 'rb') as f:
+                    img_bytes = f.read()
+            except OSError as e:
+                self.failed += 1
+                print(f"Precompute: cannot read {img_path}: {e}", file=sys.stderr)
+                continue
+            key = cache.key(img_bytes)
+            if cache.has_sidecar(img_path, key):
+                self.skipped += 1
+                continue
+            # The same image can be uploaded under several users; embed it once
+            pending.setdefault(img_bytes, []).append((img_path, key))
+
+        if not pending:
+            return
+        # Embedding by path also stores the upload's model-ready derivative (see face_derivatives.py)
+        sources = {img_bytes: targets[0][0] for img_bytes, targets in pending.items()}
+        with self.lock:
+            embeddings, errors = self.verifier.embed_images(list(sources.values()))
+
+        for img_bytes, targets in pending.items():
+            source = sources[img_bytes]
+            for img_path, key in targets:
+                if source in embeddings:
+                    cache.put_sidecar(img_path, key, embeddings[source])
+                    self.computed += 1
+                else:
+                    self.failed += 1
+                    print(f"Precompute: {img_path}: {errors.get(source)}", file=sys.stderr)
+
+    def _produce(self):
+        while not self._stop.is_set():
+            for img_path in self.scan():
+                # Blocks while the queue is full, which throttles scanning to the model's pace
+                self.queue.put(img_path)
+            self._stop.wait(self.interval)
+
+    def _consume(self):
+        while not self._stop.is_set():
+            batch = self._next_batch(timeout=self.interval)
+            if batch:
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"Precompute batch failed: {e}", file=sys.stderr)
+
+    def start(self):
+        """Run the scanner and the embedding worker on background threads"""
+        threading.Thread(target=self._produce, daemon=True).start()
+        threading.Thread(target=self._consume, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        """Embed every settled upload that has no sidecar yet, then return"""
+        paths = self.scan()
+        for i in range(0, len(paths), self.batch_size):
+            self.process(paths[i:i + self.batch_size])
+
+    def stats(self):
+        return {
+            "computed": self.computed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize
+        }
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Precompute embeddings for new face verification uploads")
+    parser.add_argument('--uploads-dir', default=UPLOADS_DIR)
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between directory scans")
+    parser.add_argument('--queue-size', type=int, default=64, help="Uploads waiting to be embedded before scanning pauses")
+    parser.add_argument('--batch-size', type=int, default=8, help="Uploads per forward pass")
+    parser.add_argument('--settle', type=float, default=1.0, help="Minimum file age in seconds before it is embedded")
+    parser.add_argument('--once', action='store_true', help="Embed existing uploads without sidecars and exit")
+    args = parser.parse_args()
+
+    from face_verification_consistent import FaceVerificationSystem
+    watcher = UploadWatcher(
+        FaceVerificationSystem(screen=False),
+        uploads_dir=args.uploads_dir,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        interval=args.interval,
+        settle=args.settle
+    )
+
+    if args.once:
+        watcher.run_once()
+        print(json.dumps({"success": True, **watcher.stats()}))
+        return
+
+    print(f"Watching {args.uploads_dir} for new uploads", file=sys.stderr)
+    watcher.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(watcher.stats()), file=sys.stderr)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Embedding-equivalence regression gate.
+
+`record` embeds a fixed local image corpus with the reference engine
+(float32 Keras by default) and saves the embeddings, the pair scores and the
+per-image latency. `compare` runs the same corpus through an alternative
+configuration (backend, quantization, input size, cropping) and reports
+cosine drift per image, score deltas per pair and flipped is_verified
+decisions next to the latency change. It exits non-zero when any tolerance is
+exceeded, so it can gate a CI job or a deploy.
+
+Usage:
+    python embedding_regression.py record reference.npz [--corpus DIR]
+    python embedding_regression.py compare reference.npz --backend tflite --quantization int8
+                                   [--max-drift 0.01] [--max-score-delta 0.02] [--max-flips 0]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+
+from bulk_reverify import UPLOADS_DIR, discover_pairs
+
+
+def corpus_pairs(corpus_dir):
+    """Sorted image paths and (gov_id, selfie) pairs: every pair per user plus one impostor pair per user"""
+    genuine = [(gov_id, selfie) for _, gov_id, selfie in discover_pairs(corpus_dir, all_pairs=True)]
+    latest = [(gov_id, selfie) for _, gov_id, selfie in discover_pairs(corpus_dir)]
+    # Each user's gov-id against the next user's selfie
+    impostor = [(latest[i][0], latest[(i + 1) % len(latest)][1]) for i in range(len(latest))] if len(latest) > 1 else []
+    pairs = genuine + impostor
+    paths = sorted({img_path for pair in pairs for img_path in pair})
+    return paths, pairs
+
+
+def make_verifier(backend=None, quantization=None, input_size=None, crop_faces=None):
+    """A verifier for one engine configuration; unset options fall back to the FACE_* environment"""
+    import face_verification_consistent as engine
+    from embedding_cache import EmbeddingCache
+
+    inference_backend = engine.get_backend(
+        backend or engine.INFERENCE_BACKEND,
+        quantization or engine.TFLITE_QUANTIZATION,
+        input_size or engine.INPUT_SIZE
+    )
+    # No cache, no perceptual-hash reuse and no quality gate: every image goes through the model
+    return engine.FaceVerificationSystem(
+        cache=EmbeddingCache('regression', max_entries=0),
+        backend=inference_backend,
+        quality_gate=False,
+        crop_faces=crop_faces,
+        screen=False,
+        phash_index=False
+    )
+
+
+def embed_corpus(verifier, paths, batch_size=8):
+    """(embedding matrix in path order, mean seconds per image)"""
+    images = []
+    for img_path in paths:
+        with open(img_path, 'rb') as f:
+            images.append(f.read())
+
+    # Warm-up so one-off graph tracing and allocation are not timed
+    verifier.embed_images(images[:1])
+    rows = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        batch = images[i:i + batch_size]
+        embeddings, errors = verifier.embed_images(batch)
+        for img_bytes, img_path in zip(batch, paths[i:i + batch_size]):
+            if img_bytes not in embeddings:
+                raise ValueError(f"Could not embed {img_path}: {errors.get(img_bytes)}")
+            rows.append(embeddings[img_bytes])
+    elapsed = time.perf_counter() - start
+    return np.stack(rows).astype(np.float32), elapsed / max(1, len(images))
+
+
+def pair_scores(verifier, embeddings, paths, pairs):
+    index = {img_path: row for row, img_path in enumerate(paths)}
+    rows1 = embeddings[[index[gov_id] for gov_id, _ in pairs]]
+    rows2 = embeddings[[index[selfie] for _, selfie in pairs]]
+    return np.array([verifier.calculate_similarity(a, b) for a, b in zip(rows1, rows2)], dtype=np.float64)
+
+
+def describe(verifier):
+    return {
+        "model_version": verifier.model_version,
+        "backend": verifier.backend.name,
+        "input_size": list(verifier.target_size),
+        "crop_faces": verifier.crop_faces,
+        "host": {"machine": platform.machine(), "cpu_count": os.cpu_count()}
+    }
+
+
+def record(output_path, corpus_dir, batch_size, **config):
+    verifier = make_verifier(**config)
+    paths, pairs = corpus_pairs(corpus_dir)
+    if not pairs:
+        raise ValueError(f"No gov-id/selfie pairs found under {corpus_dir}")
+    embeddings, seconds_per_image = embed_corpus(verifier, paths, batch_size)
+    scores = pair_scores(verifier, embeddings, paths, pairs)
+
+    metadata = describe(verifier)
+    metadata.update({"corpus": os.path.abspath(corpus_dir), "seconds_per_image": seconds_per_image})
+    corpus_root = os.path.abspath(corpus_dir)
+    np.savez(
+        output_path,
+        paths=np.array([os.path.relpath(p, corpus_root) for p in paths]),
+        pairs=np.array([[os.path.relpath(a, corpus_root), os.path.relpath(b, corpus_root)] for a, b in pairs]),
+        embeddings=embeddings,
+        scores=scores,
+        metadata=np.array(json.dumps(metadata))
+    )
+    return {"success": True, "images": len(paths), "pairs": len(pairs), **metadata}
+
+
+def compare(reference_path, corpus_dir, batch_size, threshold, max_drift, max_score_delta, max_flips, **config):
+    """Drift report of the configured engine against a recorded reference; returns (report, passed)"""
+    reference = np.load(reference_path, allow_pickle=False)
+    ref_meta = json.loads(str(reference['metadata']))
+    corpus_root = os.path.abspath(corpus_dir or ref_meta['corpus'])
+    paths = [os.path.join(corpus_root, p) for p in reference['paths']]
+    pairs = [(os.path.join(corpus_root, a), os.path.join(corpus_root, b)) for a, b in reference['pairs']]
+
+    verifier = make_verifier(**config)
+    embeddings, seconds_per_image = embed_corpus(verifier, paths, batch_size)
+    scores = pair_scores(verifier, embeddings, paths, pairs)
+
+    ref_embeddings = reference['embeddings']
+    ref_scores = reference['scores']
+    if embeddings.shape != ref_embeddings.shape:
+        raise ValueError(f"Embedding shape changed: {ref_embeddings.shape} -> {embeddings.shape}")
+
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(ref_embeddings, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosine = np.where(norms > 0, np.einsum('ij,ij->i', embeddings, ref_embeddings) / norms, 0.0)
+    drift = 1.0 - np.nan_to_num(cosine)
+    deltas = np.abs(scores - ref_scores)
+    flipped = [
+        {"gov_id": os.path.relpath(a, corpus_root), "selfie": os.path.relpath(b, corpus_root),
+         "reference_score": float(ref), "score": float(cur)}
+        for (a, b), ref, cur in zip(pairs, ref_scores, scores)
+        if (ref >= threshold) != (cur >= threshold)
+    ]
+    worst = int(np.argmax(drift))
+
+    report = {
+        "reference": ref_meta,
+        "candidate": describe(verifier),
+        "images": len(paths),
+        "pairs": len(pairs),
+        "cosine_drift": {
+            "max": float(drift.max()),
+            "mean": float(drift.mean()),
+            "p99": float(np.percentile(drift, 99)),
+            "worst_image": os.path.relpath(paths[worst], corpus_root)
+        },
+        "score_delta": {"max": float(deltas.max()), "mean": float(deltas.mean())},
+        "flipped_decisions": flipped,
+        "latency": {
+            "reference_ms_per_image": ref_meta['seconds_per_image'] * 1000,
+            "candidate_ms_per_image": seconds_per_image * 1000,
+            "speedup": ref_meta['seconds_per_image'] / seconds_per_image if seconds_per_image else None
+        },
+        "tolerances": {"max_drift": max_drift, "max_score_delta": max_score_delta, "max_flips": max_flips}
+    }
+    if ref_meta['host'] != report['candidate']['host']:
+        report['latency']['warning'] = "Reference was recorded on a different host; latency is not comparable"
+
+    failures = []
+    if drift.max() > max_drift:
+        failures.append(f"cosine drift {drift.max():.6f} > {max_drift}")
+    if deltas.max() > max_score_delta:
+        failures.append(f"score delta {deltas.max():.6f} > {max_score_delta}")
+    if len(flipped) > max_flips:
+        failures.append(f"{len(flipped)} flipped decisions > {max_flips}")
+    report["failures"] = failures
+    report["success"] = not failures
+    return report, not failures
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Embedding-equivalence regression gate")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name in ('record', 'compare'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('reference', help="Reference file (.npz)")
+        sub.add_argument('--corpus', default=None, help=f"Image corpus (default: {UPLOADS_DIR})")
+        sub.add_argument('--batch-size', type=int, default=8)
+        sub.add_argument('--backend', choices=['keras', 'tflite'], default=None)
+        sub.add_argument('--quantization', default=None, help="TFLite quantization mode")
+        sub.add_argument('--input-size', type=int, default=None)
+        crop = sub.add_mutually_exclusive_group()
+        crop.add_argument('--crop', dest='crop_faces', action='store_true', default=None)
+        crop.add_argument('--no-crop', dest='crop_faces', action='store_false')
+        if name == 'compare':
+            sub.add_argument('--threshold', type=float, default=0.7)
+            sub.add_argument('--max-drift', type=float, default=0.01, help="Largest allowed 1 - cosine per image")
+            sub.add_argument('--max-score-delta', type=float, default=0.02, help="Largest allowed score change per pair")
+            sub.add_argument('--max-flips', type=int, default=0, help="Allowed flipped is_verified decisions")
+
+    args = parser.parse_args()
+    config = {
+        "backend": args.backend,
+        "quantization": args.quantization,
+        "input_size": args.input_size,
+        "crop_faces": args.crop_faces
+    }
+
+    if args.command == 'record':
+        result = record(args.reference, args.corpus or UPLOADS_DIR, args.batch_size, **config)
+        print(json.dumps(result, indent=2))
+        return
+
+    report, passed = compare(
+        args.reference, args.corpus, args.batch_size, args.threshold,
+        args.max_drift, args.max_score_delta, args.max_flips, **config
+    )
+    print(json.dumps(report, indent=2))
+    if not passed:
+        print("Embedding regression: " + "; ".join(report["failures"]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
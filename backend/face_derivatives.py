@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Compact, model-ready derivatives of face verification uploads.
+
+The first time an upload is preprocessed, the resized (and, with cropping,
+face-cropped) uint8 image at model input resolution is saved as a lossless
+WebP in a `.derivatives` directory next to the upload. A later preprocess
+of the same file decodes that small image instead of the multi-megabyte
+phone JPEG. Because the derivative holds exactly the pixels the JPEG path
+would have produced, the embeddings are identical. A derivative is only
+kept when it is smaller than its upload, so it never costs more storage or
+I/O than it saves; small uploads keep taking the JPEG path.
+
+The file name carries a tag made from DERIVATIVE_VERSION, the input size,
+the crop mode and whether the quality gate passed. A change to any of them
+therefore never reads a derivative made under other settings. A derivative
+older than its upload is ignored.
+
+Next to the derivatives, each upload also gets a small record of its
+content hash, valid while the upload's size and mtime are unchanged. A
+verification can then look up the embedding cache, the sidecar and the
+derivative without reading the original upload at all.
+"""
+
+import os
+import json
+import threading
+
+import cv2
+
+DERIVATIVE_DIR = '.derivatives'
+# Bump when the crop/resize pipeline or the encoding changes what a derivative contains
+DERIVATIVE_VERSION = 3
+# OpenCV encodes WebP losslessly above quality 100
+ENCODE_PARAMS = [cv2.IMWRITE_WEBP_QUALITY, 101]
+
+
+def derivative_tag(target_size, quality_gate, crop_faces):
+    width, height = target_size
+    return f"v{DERIVATIVE_VERSION}-{width}x{height}-{'crop' if crop_faces else 'full'}{'-gated' if quality_gate else ''}"
+
+
+def derivative_path(img_path, target_size, quality_gate=False, crop_faces=False):
+    """Where the derivative of the upload at img_path is stored for these settings"""
+    directory, name = os.path.split(os.path.abspath(img_path))
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, DERIVATIVE_DIR, f"{stem}.{derivative_tag(target_size, quality_gate, crop_faces)}.webp")
+
+
+def read_derivative(img_path, target_size, quality_gate=False, crop_faces=False):
+    """The stored uint8 BGR derivative of img_path, or None when it is missing or stale"""
+    path = derivative_path(img_path, target_size, quality_gate, crop_faces)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(img_path):
+            return None
+    except OSError:
+        return None
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None or img.shape[:2] != (target_size[1], target_size[0]):
+        return None
+    return img
+
+
+def digest_path(img_path):
+    directory, name = os.path.split(os.path.abspath(img_path))
+    return os.path.join(directory, DERIVATIVE_DIR, f"{os.path.splitext(name)[0]}.sha256.json")
+
+
+def read_content_digest(img_path):
+    """Stored content hash of the upload at img_path, or None when missing or the file has changed"""
+    try:
+        stat = os.stat(img_path)
+        with open(digest_path(img_path)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record.get('size') != stat.st_size or record.get('mtime_ns') != stat.st_mtime_ns:
+        return None
+    return record.get('sha256')
+
+
+def write_content_digest(img_path, content_digest):
+    """Remember the content hash of the upload at img_path; returns False if it cannot be written"""
+    path = digest_path(img_path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        stat = os.stat(img_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump({"sha256": content_digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, f)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        return False
+
+
+def write_derivative(img_path, img, target_size, quality_gate=False, crop_faces=False):
+    """Store a resized uint8 BGR image as the derivative of img_path.
+
+    Returns False when it cannot be written or would not be smaller than the upload.
+    """
+    path = derivative_path(img_path, target_size, quality_gate, crop_faces)
+    # Write then rename so concurrent readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        encoded, data = cv2.imencode('.webp', img, ENCODE_PARAMS)
+        if not encoded or len(data) >= os.path.getsize(img_path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, path)
+        return True
+    except (OSError, cv2.error):
+        return False
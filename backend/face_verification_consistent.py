@@ -9,70 +9,831 @@ import cv2
 import numpy as np
 import json
 from tensorflow.keras.applications import InceptionResNetV2
-from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.models import Model
+from tensorflow.keras.models import Model, load_model
 from tensorflow.keras.layers import GlobalAveragePooling2D, Dense
+from tensorflow.keras.initializers import GlorotUniform
 from scipy.spatial.distance import cosine
 import base64
+import hashlib
 import io
+from embedding_cache import EmbeddingCache
+from inference_backends import KerasBackend, TFLiteBackend
+from framed_protocol import read_request, write_response
+from verification_metrics import Timings, NULL_TIMINGS, METRICS
+from image_quality import ImageQualityError, check_quality, locate_face, crop_face, DETECTION_MIN_SIDE
+from face_derivatives import read_derivative, write_derivative, read_content_digest, write_content_digest
+from perceptual_hash import PerceptualIndex, image_hash, MAX_DISTANCE
+from preprocess_pipeline import PreprocessPipeline
+from profiling_hook import ProfileCapture, profiled, PROFILE_DIR
 
 # Global model instance for consistent results
 MODEL = None
+MODEL_VERSION = None
+
+VERIFICATION_THRESHOLD = 0.7
+
+# Frozen model artifact written by build_face_model.py
+MODEL_ARTIFACT_DIR = os.environ.get(
+    'FACE_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_artifacts')
+)
+MODEL_ARTIFACT_VERSION = 1
+EMBEDDING_HEAD_SEED = 1337
+
+# Inference backend: 'keras' (float32) or 'tflite' (quantized, see inference_backends.py)
+INFERENCE_BACKEND = os.environ.get('FACE_INFERENCE_BACKEND', 'keras')
+TFLITE_QUANTIZATION = os.environ.get('FACE_TFLITE_QUANTIZATION', 'dynamic')
+TFLITE_NUM_THREADS = int(os.environ['FACE_TFLITE_THREADS']) if os.environ.get('FACE_TFLITE_THREADS') else None
+
+# Keras backend: compiled forward pass instead of model.predict, optionally XLA-compiled
+COMPILED_PREDICT = os.environ.get('FACE_COMPILED_PREDICT', '1').lower() in ('1', 'true', 'yes')
+XLA_COMPILE = os.environ.get('FACE_XLA', '').lower() in ('1', 'true', 'yes')
+
+# Per-stage timings in results and aggregated metrics; off by default
+INSTRUMENTATION = os.environ.get('FACE_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+
+# Reject dark, blurry and faceless uploads before inference (see image_quality.py)
+QUALITY_GATE = os.environ.get('FACE_QUALITY_GATE', '1').lower() in ('1', 'true', 'yes')
+
+# Crop to the detected face before resizing; FACE_INPUT_SIZE below 299 runs the
+# same weights on a smaller input, which the tighter crop tolerates
+CROP_FACES = os.environ.get('FACE_CROP', '1').lower() in ('1', 'true', 'yes')
+INPUT_SIZE = int(os.environ.get('FACE_INPUT_SIZE', '299'))
+
+# Cascade: score each pair on a cheap smaller-input tier first and run the full
+# model only when the cheap score is within FACE_CASCADE_BAND of the threshold
+CASCADE_INPUT_SIZE = int(os.environ['FACE_CASCADE_INPUT_SIZE']) if os.environ.get('FACE_CASCADE_INPUT_SIZE') else None
+CASCADE_BAND = float(os.environ.get('FACE_CASCADE_BAND', '0.1'))
+
+# Reuse the embedding of a near-identical earlier upload by the same user (see perceptual_hash.py)
+PERCEPTUAL_HASH = os.environ.get('FACE_PHASH', '').lower() in ('1', 'true', 'yes')
+PERCEPTUAL_HASH_DISTANCE = int(os.environ.get('FACE_PHASH_MAX_DISTANCE', str(MAX_DISTANCE)))
+PERCEPTUAL_HASH_SIZE = int(os.environ.get('FACE_PHASH_SIZE', '1024'))
+
+# Keep a small model-ready PNG of each upload next to it (see face_derivatives.py)
+DERIVATIVES = os.environ.get('FACE_DERIVATIVES', '1').lower() in ('1', 'true', 'yes')
+
+# Decode and preprocess upcoming images on a bounded thread pool while the
+# model runs; 0 workers keeps everything on the calling thread
+PREPROCESS_WORKERS = int(os.environ.get('FACE_PREPROCESS_WORKERS', '0'))
+PREFETCH_DEPTH = int(os.environ.get('FACE_PREFETCH_DEPTH', '4'))
+
+# On-disk embedding cache location; unset keeps the cache in memory only
+EMBEDDING_CACHE_DIR = os.environ.get('FACE_EMBEDDING_CACHE_DIR')
+EMBEDDING_CACHE_SIZE = int(os.environ.get('FACE_EMBEDDING_CACHE_SIZE', '512'))
+
+def build_model(input_size=299, weights='imagenet'):
+    """Build InceptionResNetV2 with a seeded, deterministic 128-d embedding head"""
+    base_model = InceptionResNetV2(
+        weights=weights, 
+        include_top=False, 
+        input_shape=(input_size, input_size, 3)
+    )
+    x = base_model.output
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(
+        128,
+        activation='relu',
+        kernel_initializer=GlorotUniform(seed=EMBEDDING_HEAD_SEED),
+        name='embedding'
+    )(x)
+    return Model(inputs=base_model.input, outputs=x, name='face_embedding')
+
+def artifact_paths(artifact_dir=MODEL_ARTIFACT_DIR, version=MODEL_ARTIFACT_VERSION):
+    """Paths of the saved model and its manifest for an artifact version"""
+    model_path = os.path.join(artifact_dir, f"face_embedding_v{version}.keras")
+    return model_path, model_path.replace('.keras', '.json')
+
+def tflite_artifact_path(quantization, artifact_dir=MODEL_ARTIFACT_DIR, version=MODEL_ARTIFACT_VERSION):
+    """Path of the TFLite conversion of an artifact version"""
+    return os.path.join(artifact_dir, f"face_embedding_v{version}_{quantization}.tflite")
+
+def load_manifest(artifact_dir=MODEL_ARTIFACT_DIR, version=MODEL_ARTIFACT_VERSION):
+    """Read the artifact manifest, or None if the artifact has not been built"""
+    model_path, manifest_path = artifact_paths(artifact_dir, version)
+    if not os.path.exists(model_path) or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def load_artifact(artifact_dir=MODEL_ARTIFACT_DIR, version=MODEL_ARTIFACT_VERSION):
+    """Load a frozen model artifact; returns (model, manifest) or (None, None) if it is missing"""
+    manifest = load_manifest(artifact_dir, version)
+    if manifest is None:
+        return None, None
+    model_path, _ = artifact_paths(artifact_dir, version)
+    return load_model(model_path, compile=False), manifest
 
 def get_model():
     """Get or create the model instance (singleton pattern)"""
-    global MODEL
+    global MODEL, MODEL_VERSION
     if MODEL is None:
-        # Loading model for the first time
-        base_model = InceptionResNetV2(
-            weights='imagenet', 
-            include_top=False, 
-            input_shape=(299, 299, 3)
-        )
-        x = base_model.output
-        x = GlobalAveragePooling2D()(x)
-        x = Dense(128, activation='relu')(x)
-        MODEL = Model(inputs=base_model.input, outputs=x)
-        # Model loaded successfully
+        MODEL, manifest = load_artifact()
+        if MODEL is not None:
+            MODEL_VERSION = manifest['version']
+        else:
+            # No artifact built yet; the seeded head still gives stable embeddings
+            print("Warning: model artifact not found, building model from ImageNet weights", file=sys.stderr)
+            MODEL = build_model()
+            MODEL_VERSION = model_fingerprint(MODEL)
     return MODEL
 
+def resize_model_input(model, input_size):
+    """The same network and weights with a different square input size"""
+    resized = build_model(input_size, weights=None)
+    resized.set_weights(model.get_weights())
+    return resized
+
+def model_fingerprint(model):
+    """Version string for a model, derived from its embedding head weights"""
+    digest = hashlib.sha256(model.name.encode('utf-8'))
+    for weights in model.layers[-1].get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return digest.hexdigest()[:16]
+
+def backend_version(name, base_version, quantization=TFLITE_QUANTIZATION, input_size=INPUT_SIZE):
+    """Version string of a backend built from the model version base_version"""
+    size_suffix = f"-in{input_size}" if input_size != 299 else ""
+    if name == 'tflite':
+        return f"{base_version}-tflite-{quantization}{size_suffix}"
+    return base_version + size_suffix
+
+def configured_model_version(name=INFERENCE_BACKEND, quantization=TFLITE_QUANTIZATION, input_size=INPUT_SIZE,
+                             crop_faces=CROP_FACES):
+    """model_version a default FaceVerificationSystem reports, read without loading the model.
+
+    Returns None for Keras without a built artifact, where only the weights fingerprint can tell.
+    """
+    manifest = load_manifest()
+    if manifest is None and name == 'keras':
+        return None
+    base_version = manifest['version'] if manifest else 'unversioned'
+    return backend_version(name, base_version, quantization, input_size) + ("-crop" if crop_faces else "")
+
+def get_backend(name=INFERENCE_BACKEND, quantization=TFLITE_QUANTIZATION, input_size=INPUT_SIZE):
+    """Create the configured inference backend"""
+    if name == 'keras':
+        model = get_model()
+        if input_size != model.input_shape[1]:
+            model = resize_model_input(model, input_size)
+        return KerasBackend(
+            model, backend_version(name, MODEL_VERSION, input_size=input_size),
+            compiled=COMPILED_PREDICT, jit_compile=XLA_COMPILE
+        )
+    if name == 'tflite':
+        # The Keras model is never loaded, which keeps the resident footprint small
+        manifest = load_manifest()
+        base_version = manifest['version'] if manifest else 'unversioned'
+        return TFLiteBackend(
+            tflite_artifact_path(quantization),
+            version=backend_version(name, base_version, quantization, input_size),
+            num_threads=TFLITE_NUM_THREADS,
+            input_size=input_size
+        )
+    raise ValueError(f"Unknown inference backend: {name}")
+
+# JPEG start-of-frame markers carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def jpeg_dimensions(data):
+    """(width, height) from a JPEG header without decoding, or None if it is not a JPEG"""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            i += 2
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+def decode_image(img_bytes, target_size=(299, 299)):
+    """Decode to BGR, letting libjpeg downscale by 2/4/8 while both sides stay >= target_size"""
+    flag = cv2.IMREAD_COLOR
+    dimensions = jpeg_dimensions(img_bytes)
+    if dimensions is not None:
+        width, height = dimensions
+        for scale, reduced_flag in REDUCED_DECODE_FLAGS:
+            if width // scale >= target_size[0] and height // scale >= target_size[1]:
+                flag = reduced_flag
+                break
+    return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flag)
+
+def crop_to_face(img_bytes, img, rotation, box, target_size=(299, 299)):
+    """Upright face crop; re-decodes img_bytes at the smallest scale where the face is not below target_size"""
+    dimensions = jpeg_dimensions(img_bytes)
+    if box[2] < target_size[0] and dimensions is not None and dimensions[0] > img.shape[1]:
+        decoded_scale = dimensions[0] / img.shape[1]
+        face_width = box[2] * decoded_scale
+        flag = cv2.IMREAD_COLOR
+        for scale, reduced_flag in REDUCED_DECODE_FLAGS:
+            if scale < decoded_scale and face_width / scale >= target_size[0]:
+                flag = reduced_flag
+                break
+        larger = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), flag)
+        if larger is not None:
+            factor = larger.shape[1] / img.shape[1]
+            box = [round(v * factor) for v in box]
+            img = larger
+    return crop_face(img, rotation, box)
+
+def preprocess_into(img_path_or_bytes, out, target_size=(299, 299), quality_gate=False, crop_faces=False,
+                    source_path=None):
+    """Decode, resize and scale one image straight into out, a (H, W, 3) float32 buffer.
+    
+    With quality_gate, the decoded image must pass check_quality first. With
+    crop_faces, the largest face (found on a downscaled copy) is cropped out
+    with a margin before resizing; images without a detectable face are used whole.
+    For a file (img_path_or_bytes itself, or source_path when bytes already read
+    from it are passed), the stored derivative is used when present and written
+    otherwise.
+    """
+    try:
+        if not isinstance(img_path_or_bytes, bytes):
+            source_path = img_path_or_bytes
+        use_derivative = DERIVATIVES and source_path is not None
+        if use_derivative:
+            derivative = read_derivative(source_path, target_size, quality_gate, crop_faces)
+            if derivative is not None:
+                return scale_into(derivative, out)
+        
+        if isinstance(img_path_or_bytes, bytes):
+            img_bytes = img_path_or_bytes
+        else:
+            try:
+                with open(img_path_or_bytes, 'rb') as f:
+                    img_bytes = f.read()
+            except OSError:
+                raise ValueError(f"Could not read image file: {img_path_or_bytes}")
+        
+        decode_size = target_size
+        if quality_gate or crop_faces:
+            decode_size = tuple(max(side, DETECTION_MIN_SIDE) for side in target_size)
+        img = decode_image(img_bytes, decode_size)
+        if img is None:
+            raise ValueError("Failed to decode image bytes")
+        rotation, box = None, None
+        if quality_gate:
+            quality = check_quality(img)
+            rotation, box = quality["rotation"], quality["face_box"]
+        elif crop_faces:
+            rotation, box = locate_face(img)
+        if crop_faces and box is not None:
+            img = crop_to_face(img_bytes, img, rotation, box, target_size)
+        
+        img = cv2.resize(img, target_size)
+        if use_derivative:
+            write_derivative(source_path, img, target_size, quality_gate, crop_faces)
+        return scale_into(img, out)
+        
+    except ImageQualityError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error processing image: {str(e)}")
+
+def resize_into(img, out, target_size=(299, 299)):
+    """Resize a decoded BGR image and write the model input into out"""
+    return scale_into(cv2.resize(img, target_size), out)
+
+def scale_into(img, out):
+    """Write the model input for an already resized BGR image into out"""
+    # BGR -> RGB and InceptionResNetV2 scaling to [-1, 1] in one pass
+    np.multiply(img[..., ::-1], 1.0 / 127.5, out=out, casting='unsafe')
+    np.subtract(out, 1.0, out=out)
+    return out
+
+def load_and_preprocess_image(img_path_or_bytes, target_size=(299, 299), quality_gate=False, crop_faces=False,
+                              source_path=None):
+    """Load and preprocess image"""
+    img_array = np.empty((1, target_size[1], target_size[0], 3), dtype=np.float32)
+    preprocess_into(img_path_or_bytes, img_array[0], target_size, quality_gate, crop_faces, source_path)
+    return img_array
+
 class FaceVerificationSystem:
-    def __init__(self):
-        """Initialize the face verification system"""
-        self.model = get_model()
+    def __init__(self, cache=None, backend=None, instrument=None, quality_gate=None, crop_faces=None,
+                 screen=None, cascade_band=None, phash_index=None, pipeline=None):
+        """Initialize the face verification system.
+
+        screen is the verifier for the cheap first cascade stage; None builds one
+        when FACE_CASCADE_INPUT_SIZE is set and False turns the cascade off.
+        phash_index and pipeline likewise default to FACE_PHASH and
+        FACE_PREPROCESS_WORKERS, and False turns them off.
+        """
+        self.instrument = INSTRUMENTATION if instrument is None else instrument
+        self.quality_gate = QUALITY_GATE if quality_gate is None else quality_gate
+        self.crop_faces = CROP_FACES if crop_faces is None else crop_faces
+        self.metrics = METRICS
+        self.backend = backend if backend is not None else get_backend()
+        self.model = self.backend.model
+        self.target_size = self.backend.input_size
+        # Cropping changes the embeddings, so it is part of the cache/version key
+        self.model_version = self.backend.version + ("-crop" if self.crop_faces else "")
+        if cache is None:
+            # The gate leaves embeddings unchanged, but a cache or sidecar hit skips
+            # check_quality, so entries made with and without it are kept apart
+            cache = EmbeddingCache(
+                self.model_version + ("-gated" if self.quality_gate else ""),
+                max_entries=EMBEDDING_CACHE_SIZE,
+                cache_dir=EMBEDDING_CACHE_DIR
+            )
+        self.cache = cache
+        if phash_index is None and PERCEPTUAL_HASH:
+            phash_index = PerceptualIndex(PERCEPTUAL_HASH_SIZE, PERCEPTUAL_HASH_DISTANCE)
+        self.phash_index = phash_index or None
+        if pipeline is None and PREPROCESS_WORKERS > 0:
+            pipeline = PreprocessPipeline(PREPROCESS_WORKERS, PREFETCH_DEPTH)
+        self.pipeline = pipeline or None
+        # Armed by profile_next; verification calls check it before anything else
+        self.profiler = None
+
+        if screen is None and CASCADE_INPUT_SIZE and CASCADE_INPUT_SIZE != self.target_size[0]:
+            screen = FaceVerificationSystem(
+                backend=get_backend(self.backend.name, TFLITE_QUANTIZATION, CASCADE_INPUT_SIZE),
+                instrument=False,
+                quality_gate=self.quality_gate,
+                crop_faces=self.crop_faces,
+                screen=False,
+                pipeline=False
+            )
+        self.screen = screen or None
+        self.cascade_band = CASCADE_BAND if cascade_band is None else cascade_band
+        self.cascade_counts = {"screen_exits": 0, "full_passes": 0, "screen_skips": 0}
+    
+    def profile_next(self, count=1, output_dir=None):
+        """Profile the next count verification calls (see profiling_hook.py); returns the capture"""
+        if self.profiler is not None:
+            # Its TensorFlow profiler and tracemalloc would otherwise stay on
+            self.profiler.stop()
+        self.profiler = ProfileCapture(count, output_dir or PROFILE_DIR)
+        return self.profiler
+    
+    def read_image_bytes(self, img_path_or_bytes):
+        """Return the raw encoded image bytes for a path or bytes input"""
+        if isinstance(img_path_or_bytes, bytes):
+            return img_path_or_bytes
+        try:
+            with open(img_path_or_bytes, 'rb') as f:
+                return f.read()
+        except OSError:
+            raise ValueError(f"Could not read image file: {img_path_or_bytes}")
     
-    def load_and_preprocess_image(self, img_path, target_size=(299, 299)):
+    def load_and_preprocess_image(self, img_path_or_bytes, target_size=None, source_path=None):
         """Load and preprocess image"""
+        return load_and_preprocess_image(
+            img_path_or_bytes, target_size or self.target_size, self.quality_gate, self.crop_faces, source_path
+        )
+    
+    def extract_face_embedding(self, img_array, cache_key=None):
+        """Extract face embedding using the pre-trained model"""
         try:
-            img = cv2.imread(img_path)
-            if img is None:
-                raise ValueError(f"Could not read image file: {img_path}")
-            
-            # Convert BGR to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if cache_key is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            embedding = self.backend.predict(img_array).flatten()
+            if cache_key is not None:
+                self.cache.put(cache_key, embedding)
+            return embedding
+        except Exception as e:
+            raise ValueError(f"Error extracting face embedding: {str(e)}")
+    
+    def extract_face_embeddings(self, img_batch):
+        """Extract embeddings for a stacked batch of images in one forward pass"""
+        try:
+            embeddings = self.backend.predict(img_batch)
+            return embeddings.reshape(len(img_batch), -1)
+        except Exception as e:
+            raise ValueError(f"Error extracting face embeddings: {str(e)}")
+    
+    def get_face_embedding(self, img_path_or_bytes, timings=NULL_TIMINGS):
+        """Embedding for an image, served from the cache when its bytes were seen before"""
+        return self._embed_prepared_image(
+            self._prepare_image(img_path_or_bytes, timings), timings, self._phash_scope(img_path_or_bytes)
+        )
+    
+    def _cache_key(self, img_path_or_bytes):
+        """(cache key, input to preprocess on a miss).
+        
+        A file whose content hash is stored next to its derivatives is not read;
+        the path is returned and preprocessing reads it only without a derivative.
+        Otherwise the bytes read for the hash are returned.
+        """
+        source = self._sidecar_source(img_path_or_bytes)
+        if DERIVATIVES and source is not None:
+            content_digest = read_content_digest(source)
+            if content_digest is not None:
+                return self.cache.key_for_digest(content_digest), source
+        img_bytes = self.read_image_bytes(img_path_or_bytes)
+        content_digest = self.cache.content_digest(img_bytes)
+        if DERIVATIVES and source is not None:
+            write_content_digest(source, content_digest)
+        return self.cache.key_for_digest(content_digest), img_bytes
+    
+    def _lookup_image(self, img_path_or_bytes, timings=NULL_TIMINGS):
+        """(embedding from the cache or a sidecar or None, image bytes or path to preprocess, cache key)"""
+        with timings.stage('load'):
+            cache_key, image = self._cache_key(img_path_or_bytes)
+            cached = self.cache.get(cache_key, self._sidecar_source(img_path_or_bytes))
+        timings.add('images')
+        return cached, image, cache_key
+    
+    def _prepare_image(self, img_path_or_bytes, timings=NULL_TIMINGS, lookup=None):
+        """(cached embedding, None, None) on a cache hit, else (None, preprocessed input, cache key).
+        
+        lookup is an earlier _lookup_image result for the same input.
+        """
+        cached, image, cache_key = lookup or self._lookup_image(img_path_or_bytes, timings)
+        if cached is not None:
+            timings.add('cache_hits')
+            return cached, None, None
+        timings.add('cache_misses')
+        with timings.stage('preprocess'):
+            img_array = self.load_and_preprocess_image(
+                image, source_path=self._sidecar_source(img_path_or_bytes)
+            )
+        return None, img_array, cache_key
+    
+    def _embed_prepared_image(self, prepared, timings=NULL_TIMINGS, phash_scope=None):
+        cached, img_array, cache_key = prepared
+        if cached is not None:
+            return cached
+        embedding, input_hash = self._phash_lookup(img_array[0], phash_scope, timings)
+        if embedding is None:
+            with timings.stage('embed'):
+                embedding = self.backend.predict(img_array).flatten()
+            timings.set('batch_size', 1)
+            if input_hash is not None:
+                self.phash_index.add(input_hash, embedding, phash_scope)
+        self.cache.put(cache_key, embedding)
+        return embedding
+    
+    def _phash_scope(self, img_path_or_bytes):
+        """Upload directory an input may share embeddings with, or None when it has no path.
+        
+        Near-identical images are only matched within one user's directory, so one
+        user's upload can never stand in for another's.
+        """
+        source = self._sidecar_source(img_path_or_bytes)
+        return os.path.dirname(os.path.abspath(source)) if source is not None else None
+    
+    def _phash_lookup(self, img, scope, timings=NULL_TIMINGS):
+        """(stored embedding of a near-identical earlier input in scope or None, perceptual hash of img or None)"""
+        if self.phash_index is None or scope is None:
+            return None, None
+        with timings.stage('phash'):
+            input_hash = image_hash(img)
+            embedding = self.phash_index.lookup(input_hash, scope)
+        if embedding is not None:
+            timings.add('phash_hits')
+        return embedding, input_hash
+    
+    def _sidecar_source(self, img_path_or_bytes):
+        """The image path behind an input, next to which sidecars and derivatives are kept, if the input is a file"""
+        return None if isinstance(img_path_or_bytes, bytes) else img_path_or_bytes
+    
+    def embed_images(self, img_paths_or_bytes):
+        """Embeddings for many images in one forward pass; returns (embedding by input, errors by input)"""
+        index, matrix, errors, _, _ = self._embed_unique_images(img_paths_or_bytes)
+        return {img: matrix[row] for img, row in index.items()}, errors
+    
+    def cascade_stats(self):
+        """Pairs answered by each cascade stage and the share of screened pairs that exited after the cheap one.
+        
+        screen_skips counts pairs whose full-model embeddings were already stored, which skip the screen.
+        """
+        if self.screen is None:
+            return None
+        total = self.cascade_counts["screen_exits"] + self.cascade_counts["full_passes"]
+        return {
+            "screen_version": self.screen.model_version,
+            "band": self.cascade_band,
+            **self.cascade_counts,
+            "screen_exit_rate": round(self.cascade_counts["screen_exits"] / total, 4) if total else None
+        }
+    
+    def _screen_score(self, img1_path, img2_path):
+        """Cheap-stage similarity of a pair, or None when the cheap stage could not score it"""
+        try:
+            embedding1 = self.screen.get_face_embedding(img1_path)
+            embedding2 = self.screen.get_face_embedding(img2_path)
+        except ImageQualityError:
+            # Both stages share the quality gate; let the full stage report the rejection
+            return None
+        except Exception as e:
+            print(f"Warning: cascade screen failed, using the full model: {e}", file=sys.stderr)
+            return None
+        return self.calculate_similarity(embedding1, embedding2)
+    
+    def _start_timings(self):
+        return Timings() if self.instrument else NULL_TIMINGS
+    
+    def _finish(self, result, timings, operation):
+        """Attach the timings block to a result and feed the metrics registry"""
+        if timings.enabled:
+            block = timings.as_dict()
+            result["timings"] = block
+            self.metrics.record(block, operation)
+        return result
+    
+    def calculate_similarity_matrix(self, embeddings1, embeddings2):
+        """Cosine similarity between every row of embeddings1 and every row of embeddings2"""
+        embeddings1 = np.asarray(embeddings1, dtype=np.float64)
+        embeddings2 = np.asarray(embeddings2, dtype=np.float64)
+        
+        norms1 = np.linalg.norm(embeddings1, axis=1, keepdims=True)
+        norms2 = np.linalg.norm(embeddings2, axis=1, keepdims=True)
+        
+        # NaN or zero rows score 0.0, the same as calculate_similarity
+        valid1 = (norms1[:, 0] > 0) & ~np.any(np.isnan(embeddings1), axis=1)
+        valid2 = (norms2[:, 0] > 0) & ~np.any(np.isnan(embeddings2), axis=1)
+        
+        normalized1 = np.where(valid1[:, None], embeddings1 / np.where(norms1 > 0, norms1, 1.0), 0.0)
+        normalized2 = np.where(valid2[:, None], embeddings2 / np.where(norms2 > 0, norms2, 1.0), 0.0)
+        
+        similarities = normalized1 @ normalized2.T
+        return np.clip(np.nan_to_num(similarities), 0.0, 1.0)
+    
+    def _embed_unique_images(self, img_paths, target_size=None, timings=NULL_TIMINGS):
+        """Embed each distinct path once, batching every cache miss into one model.predict.
+        
+        Returns (row index by path, embedding matrix, errors by path, quality-gate
+        rejections by path, forward pass batch size).
+        """
+        return self._embed_prepared(self._prepare_images(img_paths, target_size, timings), timings)
+    
+    def _prepare_images(self, img_paths, target_size=None, timings=NULL_TIMINGS, parallel=True):
+        """Everything before the forward pass: cache lookups, then preprocessing of every miss.
+        
+        With a pipeline and parallel, the misses are preprocessed on its workers.
+        """
+        errors = {}
+        rejections = {}
+        target_size = target_size or self.target_size
+        embeddings = {}
+        misses = []
+        with timings.stage('load'):
+            for img_path in dict.fromkeys(img_paths):
+                try:
+                    cache_key, image = self._cache_key(img_path)
+                    cached = self.cache.get(cache_key, self._sidecar_source(img_path))
+                    if cached is None:
+                        misses.append((img_path, cache_key, image))
+                    else:
+                        embeddings[img_path] = cached
+                except Exception as e:
+                    errors[img_path] = str(e)
+        timings.add('images', len(embeddings) + len(misses))
+        timings.add('cache_hits', len(embeddings))
+        timings.add('cache_misses', len(misses))
+        
+        # Preprocess every miss directly into its row of one preallocated batch
+        batch = np.empty((len(misses), target_size[1], target_size[0], 3), dtype=np.float32)
+        
+        def preprocess(row):
+            img_path, _, image = misses[row]
+            try:
+                preprocess_into(
+                    image, batch[row], target_size, self.quality_gate, self.crop_faces,
+                    self._sidecar_source(img_path)
+                )
+                return None
+            except Exception as e:
+                return e
+        
+        decoded = []
+        with timings.stage('preprocess'):
+            rows = range(len(misses))
+            use_pipeline = parallel and self.pipeline is not None and len(misses) > 1
+            for row, error in zip(rows, self.pipeline.map(preprocess, rows) if use_pipeline else map(preprocess, rows)):
+                img_path, cache_key, _ = misses[row]
+                if error is None:
+                    decoded.append((row, img_path, cache_key))
+                    continue
+                errors[img_path] = str(error)
+                if isinstance(error, ImageQualityError):
+                    rejections[img_path] = error.as_dict()
+        return img_paths, embeddings, batch, decoded, errors, rejections
+    
+    def _embed_prepared(self, prepared, timings=NULL_TIMINGS):
+        """The forward pass over a _prepare_images result; returns what _embed_unique_images does"""
+        img_paths, embeddings, batch, decoded, errors, rejections = prepared
+        
+        # Near-identical inputs reuse a stored embedding; only the rest go to the model.
+        # A batch-local index also sends near-duplicates within this batch through once.
+        pending = []
+        duplicates = []
+        batch_index = PerceptualIndex(len(decoded), self.phash_index.max_distance) if self.phash_index else None
+        for row, img_path, cache_key in decoded:
+            scope = self._phash_scope(img_path)
+            embedding, input_hash = self._phash_lookup(batch[row], scope, timings)
+            if embedding is not None:
+                self.cache.put(cache_key, embedding)
+                embeddings[img_path] = embedding
+                continue
+            first = batch_index.lookup(input_hash, scope) if input_hash is not None else None
+            if first is not None:
+                timings.add('phash_hits')
+                duplicates.append((img_path, cache_key, first))
+                continue
+            if input_hash is not None:
+                batch_index.add(input_hash, len(pending), scope)
+            pending.append((row, img_path, cache_key, input_hash))
+        
+        if pending:
+            timings.set('batch_size', len(pending))
+            pending_rows = [row for row, _, _, _ in pending]
+            model_input = batch[:len(pending)] if pending_rows == list(range(len(pending))) else batch[pending_rows]
+            with timings.stage('embed'):
+                batch_embeddings = self.extract_face_embeddings(model_input)
+            for (_, img_path, cache_key, input_hash), embedding in zip(pending, batch_embeddings):
+                self.cache.put(cache_key, embedding)
+                embeddings[img_path] = embedding
+                if input_hash is not None:
+                    self.phash_index.add(input_hash, embedding, self._phash_scope(img_path))
+            for img_path, cache_key, first in duplicates:
+                embedding = batch_embeddings[first]
+                self.cache.put(cache_key, embedding)
+                embeddings[img_path] = embedding
+        
+        index = {}
+        rows = []
+        for img_path in dict.fromkeys(img_paths):
+            if img_path in embeddings:
+                index[img_path] = len(rows)
+                rows.append(embeddings[img_path])
+        
+        matrix = np.stack(rows) if rows else None
+        return index, matrix, errors, rejections, len(pending)
+    
+    def _aggregate_decision(self, scores, threshold):
+        """Per-user decision: verified when the best scoring pair clears the threshold"""
+        if len(scores) == 0:
+            return {"match_score": 0.0, "is_verified": False, "threshold": threshold, "pairs_scored": 0}
+        best = float(np.max(scores))
+        return {
+            "match_score": best,
+            "mean_score": float(np.mean(scores)),
+            "is_verified": bool(best >= threshold),
+            "threshold": threshold,
+            "pairs_scored": int(len(scores))
+        }
+    
+    @profiled
+    def verify_faces_batch(self, pairs, threshold=VERIFICATION_THRESHOLD):
+        """Verify many (gov_id_path, selfie_path) pairs with a single model.predict"""
+        return self._verify_batch(pairs, threshold, self._start_timings())
+    
+    def verify_faces_stream(self, pairs, batch_size=16, threshold=VERIFICATION_THRESHOLD):
+        """Yield verify_faces_batch results for consecutive batches of pairs.
+        
+        With a pipeline, upcoming batches are read and preprocessed on its
+        workers while the current one is in inference, at most prefetch
+        batches ahead.
+        """
+        pairs = [tuple(pair) for pair in pairs]
+        batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+        if self.pipeline is None:
+            for batch in batches:
+                yield self.verify_faces_batch(batch, threshold)
+            return
+        
+        def prepare(batch):
+            timings = self._start_timings()
+            try:
+                img_paths = [img_path for pair in batch for img_path in pair]
+                return batch, timings, self._prepare_images(img_paths, timings=timings, parallel=False)
+            except Exception:
+                # Prepared again, and reported, by _verify_batch
+                return batch, timings, None
+        
+        for batch, timings, prepared in self.pipeline.map(prepare, batches):
+            yield self._verify_batch(batch, threshold, timings, prepared)
+    
+    def _verify_batch(self, pairs, threshold, timings, prepared=None):
+        try:
+            pairs = [tuple(pair) for pair in pairs]
+            img_paths = [img_path for pair in pairs for img_path in pair]
+            if prepared is None:
+                prepared = self._prepare_images(img_paths, timings=timings)
+            index, embeddings, errors, rejections, batch_size = self._embed_prepared(prepared, timings)
             
-            # Resize image
-            img = cv2.resize(img, target_size)
+            scored = [i for i, (a, b) in enumerate(pairs) if a in index and b in index]
+            scores = np.zeros(len(pairs))
+            if scored:
+                with timings.stage('similarity'):
+                    rows1 = embeddings[[index[pairs[i][0]] for i in scored]]
+                    rows2 = embeddings[[index[pairs[i][1]] for i in scored]]
+                    norms = np.linalg.norm(rows1, axis=1) * np.linalg.norm(rows2, axis=1)
+                    dots = np.einsum('ij,ij->i', rows1, rows2)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        pair_scores = np.where(norms > 0, dots / norms, 0.0)
+                    scores[scored] = np.clip(np.nan_to_num(pair_scores), 0.0, 1.0)
             
-            # Convert to array and preprocess
-            img_array = image.img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = preprocess_input(img_array)
+            results = []
+            for i, (gov_id_path, selfie_path) in enumerate(pairs):
+                error = errors.get(gov_id_path) or errors.get(selfie_path)
+                if error:
+                    result = {
+                        "success": False,
+                        "error": error,
+                        "match_score": 0.0,
+                        "is_verified": False,
+                        "message": f"Face verification failed: {error}"
+                    }
+                    for role, img_path in (('gov_id', gov_id_path), ('selfie', selfie_path)):
+                        if img_path in rejections:
+                            result["rejected"] = True
+                            result["rejection"] = {"image": role, **rejections[img_path]}
+                            break
+                    results.append(result)
+                    continue
+                results.append({
+                    "success": True,
+                    "match_score": float(scores[i]),
+                    "is_verified": bool(scores[i] >= threshold),
+                    "threshold": threshold,
+                    "message": "Face verification completed successfully"
+                })
             
-            return img_array
+            return self._finish({
+                "success": True,
+                "results": results,
+                "decision": self._aggregate_decision(scores[scored], threshold),
+                "batch_size": batch_size,
+                "message": "Batch face verification completed successfully"
+            }, timings, 'verify_batch')
             
         except Exception as e:
-            raise ValueError(f"Error processing image: {str(e)}")
+            return self._finish({
+                "success": False,
+                "error": str(e),
+                "results": [],
+                "message": f"Batch face verification failed: {str(e)}"
+            }, timings, 'verify_batch')
     
-    def extract_face_embedding(self, img_array):
-        """Extract face embedding using the pre-trained model"""
+    @profiled
+    def verify_user_images(self, gov_id_paths, selfie_paths, threshold=VERIFICATION_THRESHOLD):
+        """Score k government IDs against m selfies for one user with a single model.predict"""
+        timings = self._start_timings()
         try:
-            # Warm up model on first call
-            embedding = self.model.predict(img_array, verbose=0)
-            return embedding.flatten()
+            index, embeddings, errors, rejections, batch_size = self._embed_unique_images(
+                list(gov_id_paths) + list(selfie_paths), timings=timings
+            )
+            gov_ids = [p for p in gov_id_paths if p in index]
+            selfies = [p for p in selfie_paths if p in index]
+            if not gov_ids or not selfies:
+                raise ValueError("At least one readable government ID and selfie image is required")
+            
+            with timings.stage('similarity'):
+                matrix = self.calculate_similarity_matrix(
+                    embeddings[[index[p] for p in gov_ids]],
+                    embeddings[[index[p] for p in selfies]]
+                )
+            
+            results = []
+            for i, gov_id_path in enumerate(gov_ids):
+                for j, selfie_path in enumerate(selfies):
+                    results.append({
+                        "gov_id": gov_id_path,
+                        "selfie": selfie_path,
+                        "match_score": float(matrix[i, j]),
+                        "is_verified": bool(matrix[i, j] >= threshold)
+                    })
+            
+            return self._finish({
+                "success": True,
+                "results": results,
+                "similarity_matrix": matrix.tolist(),
+                "decision": self._aggregate_decision(matrix.ravel(), threshold),
+                "errors": errors,
+                "rejections": rejections,
+                "batch_size": batch_size,
+                "message": "Face verification completed successfully"
+            }, timings, 'verify_user')
+            
         except Exception as e:
-            raise ValueError(f"Error extracting face embedding: {str(e)}")
+            return self._finish({
+                "success": False,
+                "error": str(e),
+                "match_score": 0.0,
+                "is_verified": False,
+                "message": f"Face verification failed: {str(e)}"
+            }, timings, 'verify_user')
     
     def calculate_similarity(self, embedding1, embedding2):
         """Calculate cosine similarity between two embeddings with NaN handling"""
@@ -122,22 +883,65 @@ class FaceVerificationSystem:
             print(f"Error in similarity calculation: {str(e)}", file=sys.stderr)
             return 0.0
     
+    @profiled
     def verify_faces(self, img1_path, img2_path):
         """Main function to verify if two images contain the same face"""
+        timings = self._start_timings()
+        threshold = VERIFICATION_THRESHOLD
         try:
-            # Load and preprocess images
-            img1_array = self.load_and_preprocess_image(img1_path)
-            img2_array = self.load_and_preprocess_image(img2_path)
-            
-            # Extract embeddings
-            embedding1 = self.extract_face_embedding(img1_array)
-            embedding2 = self.extract_face_embedding(img2_array)
+            cascade = None
+            lookups = (None, None)
+            if self.screen is not None:
+                # Pairs already embedded by the full model would only pay for two extra passes
+                lookups = tuple(self._lookup_image(img_path, timings) for img_path in (img1_path, img2_path))
+            if self.screen is not None and all(lookup[0] is not None for lookup in lookups):
+                self.cascade_counts["screen_skips"] += 1
+            elif self.screen is not None:
+                with timings.stage('screen'):
+                    screen_score = self._screen_score(img1_path, img2_path)
+                # Far from the threshold the cheap score already decides the pair
+                if screen_score is not None and abs(screen_score - threshold) > self.cascade_band:
+                    self.cascade_counts["screen_exits"] += 1
+                    self.metrics.increment('cascade_screen_exits_total')
+                    return self._finish({
+                        "success": True,
+                        "match_score": float(screen_score),
+                        "is_verified": bool(screen_score >= threshold),
+                        "threshold": threshold,
+                        "cascade": {"stage": "screen", "screen_version": self.screen.model_version},
+                        "message": "Face verification completed successfully"
+                    }, timings, 'verify')
+                self.cascade_counts["full_passes"] += 1
+                self.metrics.increment('cascade_full_passes_total')
+                cascade = {"stage": "full", "screen_score": screen_score}
+
+            # Extract embeddings, skipping the model for images seen before. With a
+            # pipeline, the selfie is prepared on a worker while the gov-id is embedded.
+            selfie = None
+            if self.pipeline is not None:
+                selfie_timings = self._start_timings()
+                selfie = (
+                    self.pipeline.submit(self._prepare_image, img2_path, selfie_timings, lookups[1]), selfie_timings
+                )
+            embeddings = []
+            for role, img_path, lookup in (('gov_id', img1_path, lookups[0]), ('selfie', img2_path, lookups[1])):
+                try:
+                    if role == 'selfie' and selfie is not None:
+                        prepared = selfie[0].result()
+                        timings.merge(selfie[1])
+                    else:
+                        prepared = self._prepare_image(img_path, timings, lookup)
+                    embeddings.append(self._embed_prepared_image(prepared, timings, self._phash_scope(img_path)))
+                except ImageQualityError as e:
+                    e.image = role
+                    raise
+            embedding1, embedding2 = embeddings
             
             # Calculate similarity
-            similarity_score = self.calculate_similarity(embedding1, embedding2)
+            with timings.stage('similarity'):
+                similarity_score = self.calculate_similarity(embedding1, embedding2)
             
             # Determine verification result
-            threshold = 0.7
             is_verified = similarity_score >= threshold
             
             result = {
@@ -147,26 +951,97 @@ class FaceVerificationSystem:
                 "threshold": threshold,
                 "message": "Face verification completed successfully"
             }
+            if cascade is not None:
+                result["cascade"] = cascade
             
-            return result
+            return self._finish(result, timings, 'verify')
             
+        except ImageQualityError as e:
+            return self._finish({
+                "success": False,
+                "error": str(e),
+                "rejected": True,
+                "rejection": e.as_dict(),
+                "match_score": 0.0,
+                "is_verified": False,
+                "message": f"Face verification failed: {str(e)}"
+            }, timings, 'verify')
         except Exception as e:
-            return {
+            return self._finish({
                 "success": False,
                 "error": str(e),
                 "match_score": 0.0,
                 "is_verified": False,
                 "message": f"Face verification failed: {str(e)}"
-            }
+            }, timings, 'verify')
+
+def serve_framed_stdin(verifier):
+    """Answer framed binary requests on stdin until it is closed (see framed_protocol.py)"""
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    while True:
+        try:
+            request = read_request(stdin)
+        except (EOFError, ValueError) as e:
+            write_response(stdout, {"success": False, "error": f"Invalid request frame: {e}"})
+            return
+        if request is None:
+            return
+        
+        header, images = request
+        if header.get('op') == 'profile':
+            try:
+                result = {"success": True, "profile": verifier.profile_next(int(header.get('count', 1))).status()}
+            except (TypeError, ValueError) as e:
+                result = {"success": False, "error": str(e)}
+        elif 'gov_id' not in images or 'selfie' not in images:
+            result = {"success": False, "error": "Both gov_id and selfie images are required"}
+        else:
+            result = verifier.verify_faces(images['gov_id'], images['selfie'])
+        if 'id' in header:
+            result['id'] = header['id']
+        write_response(stdout, result)
+
+def pop_option(args, name, default=None):
+    """Remove `name value` from args and return value"""
+    if name not in args:
+        return default
+    i = args.index(name)
+    if i + 1 >= len(args):
+        print(f"Missing value for {name}")
+        sys.exit(1)
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
 
 def main():
     """Main function"""
-    if len(sys.argv) != 3:
+    args = sys.argv[1:]
+    profile_dir = pop_option(args, '--profile')
+    profile_count = pop_option(args, '--profile-count')
+    if profile_count is not None:
+        if not profile_dir or args != ['--stdin']:
+            print("--profile-count only applies with --profile and --stdin; a single pair is one verification")
+            sys.exit(1)
+        if not profile_count.isdigit() or int(profile_count) < 1:
+            print(f"Invalid value for --profile-count: {profile_count!r} (expected a positive integer)")
+            sys.exit(1)
+    profile_count = int(profile_count or 1)
+    
+    if args == ['--stdin']:
+        verifier = FaceVerificationSystem()
+        if profile_dir:
+            verifier.profile_next(profile_count, profile_dir)
+        serve_framed_stdin(verifier)
+        return
+    
+    if len(args) != 2:
         print("Usage: python face_verification_consistent.py <government_id_image_path> <selfie_image_path>")
+        print("   or: python face_verification_consistent.py --stdin   (framed binary images on stdin)")
+        print("Options: --profile DIR [--profile-count N]   (profile the next verification, or the next N with --stdin, into DIR)")
         sys.exit(1)
     
-    gov_id_path = sys.argv[1]
-    selfie_path = sys.argv[2]
+    gov_id_path, selfie_path = args
     
     if not os.path.exists(gov_id_path) or not os.path.exists(selfie_path):
         print(json.dumps({"success": False, "error": "Image files not found"}))
@@ -174,6 +1049,8 @@ def main():
     
     # Initialize verification system
     verifier = FaceVerificationSystem()
+    if profile_dir:
+        verifier.profile_next(profile_count, profile_dir)
     
     # Perform verification
     result = verifier.verify_faces(gov_id_path, selfie_path)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Pre-fork worker pool for the face verification engine.
+
+The parent imports TensorFlow and loads the model once, then forks N workers
+that inherit the weights copy-on-write. Each worker runs with pinned
+intra-op/inter-op thread counts and serves one request at a time over a
+socketpair; the parent hands each request to the next idle worker.
+
+TensorFlow's eager runtime is not fork-safe, so with the Keras backend each
+worker loads its own model right after the fork instead. Every worker sends
+a ready frame once its initialisation finishes, or the load error if it
+failed, and takes no requests before then.
+
+Used by face_verification_server.py --workers N.
+"""
+
+import os
+import sys
+import json
+import queue
+import socket
+import threading
+
+
+def configure_threads(intra_op_threads, inter_op_threads):
+    """Pin TensorFlow/OpenMP thread counts; must run before TensorFlow executes any op"""
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    os.environ.setdefault('FACE_TFLITE_THREADS', str(intra_op_threads))
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+class _Worker:
+    def __init__(self, index, pid, sock):
+        self.index = index
+        self.pid = pid
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.wfile = sock.makefile('wb')
+        self.alive = True
+        self.ready = False
+        self.load_error = None
+        self.requests_served = 0
+
+
+class PreforkPool:
+    def __init__(self, num_workers, intra_op_threads=1, inter_op_threads=1):
+        """Create a pool; call start() from a single-threaded parent"""
+        self.num_workers = num_workers
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.workers = []
+        self._requests = queue.Queue()
+
+    def start(self, handle_request, init_worker=None):
+        """Fork the workers; handle_request(dict) -> dict runs inside each worker.
+
+        init_worker, if given, runs once in each worker right after the fork and
+        returns an error message if the worker cannot serve. No other threads may
+        be running when this is called.
+        """
+        for index in range(self.num_workers):
+            parent_sock, child_sock = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                parent_sock.close()
+                for worker in self.workers:
+                    worker.sock.close()
+                error = init_worker() if init_worker is not None else None
+                child_sock.sendall((json.dumps({"ready": error is None, "load_error": error}) + "\n").encode('utf-8'))
+                if error is None:
+                    self._worker_loop(child_sock, handle_request)
+                os._exit(0 if error is None else 1)
+
+            child_sock.close()
+            self.workers.append(_Worker(index, pid, parent_sock))
+
+        for worker in self.workers:
+            threading.Thread(target=self._dispatch_loop, args=(worker,), daemon=True).start()
+
+    def _worker_loop(self, sock, handle_request):
+        rfile = sock.makefile('rb')
+        wfile = sock.makefile('wb')
+        for raw in rfile:
+            try:
+                response = handle_request(json.loads(raw))
+            except Exception as e:
+                response = {"success": False, "error": str(e)}
+            wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            wfile.flush()
+
+    def _await_ready(self, worker):
+        """Block until the worker reports its initialisation; returns whether it can serve"""
+        try:
+            raw = worker.rfile.readline()
+            frame = json.loads(raw) if raw else {"load_error": "exited during startup"}
+        except (OSError, ValueError) as e:
+            frame = {"load_error": str(e)}
+        if frame.get('ready'):
+            worker.ready = True
+            return True
+        worker.load_error = frame.get('load_error') or "not ready"
+        self._worker_stopped(worker, f"failed to load: {worker.load_error}")
+        return False
+
+    def _worker_stopped(self, worker, reason):
+        worker.alive = False
+        print(f"Face verification worker {worker.index} stopped: {reason}", file=sys.stderr)
+        if not any(w.alive for w in self.workers):
+            # Nobody is left to take queued requests
+            while True:
+                try:
+                    _, slot = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                slot['response'] = {"success": False, "error": "No face verification workers are running"}
+                slot['done'].set()
+
+    def _dispatch_loop(self, worker):
+        """Feed requests to one worker; whichever worker is idle takes the next request"""
+        if not self._await_ready(worker):
+            return
+        while True:
+            request, slot = self._requests.get()
+            try:
+                worker.wfile.write((json.dumps(request) + "\n").encode('utf-8'))
+                worker.wfile.flush()
+                raw = worker.rfile.readline()
+                if not raw:
+                    raise ConnectionError(f"worker {worker.index} (pid {worker.pid}) exited")
+                slot['response'] = json.loads(raw)
+                worker.requests_served += 1
+            except (OSError, ValueError, ConnectionError) as e:
+                slot['response'] = {"success": False, "error": f"Worker failed: {e}"}
+                slot['done'].set()
+                self._worker_stopped(worker, e)
+                return
+            slot['done'].set()
+
+    def submit(self, request):
+        """Run one request on the next idle worker and wait for its response"""
+        if not any(worker.alive for worker in self.workers):
+            return {"success": False, "error": "No face verification workers are running"}
+        slot = {'done': threading.Event(), 'response': None}
+        self._requests.put((request, slot))
+        slot['done'].wait()
+        return slot['response']
+
+    def status(self):
+        return {
+            "workers": [
+                {
+                    "index": worker.index,
+                    "pid": worker.pid,
+                    "alive": worker.alive,
+                    "ready": worker.ready,
+                    "load_error": worker.load_error,
+                    "requests_served": worker.requests_served
+                }
+                for worker in self.workers
+            ],
+            "queued": self._requests.qsize(),
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads
+        }
+
+    def stop(self):
+        for worker in self.workers:
+            try:
+                worker.sock.close()
+            except OSError:
+                pass
+        for worker in self.workers:
+            try:
+                os.waitpid(worker.pid, 0)
+            except ChildProcessError:
+                pass
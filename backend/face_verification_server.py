@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Long-lived face verification server.
+
+Loads the model once and serves many verifications over a JSON-lines channel,
+either stdin/stdout (default) or a local Unix socket.
+
+Usage: python face_verification_server.py [--socket /path/to/face.sock] [--workers N]
+                                         [--batch-window-ms 5 --max-batch-size 16]
+                                         [--instrument] [--metrics-file /path/to/face.prom]
+                                         [--precompute-uploads] [--light-input-size 160]
+                                         [--profile-dir /path/to/profiles]
+
+With --workers N the model is loaded once and N pre-forked workers share it
+copy-on-write (see face_verification_pool.py). This needs
+FACE_INFERENCE_BACKEND=tflite; --keras-workers accepts one Keras model copy
+per worker instead. The server reports ready once a worker has loaded. With --batch-window-ms the
+in-process model is fed by a micro-batching scheduler instead: concurrent
+requests are coalesced into shared forward passes (see micro_batcher.py).
+
+Each request is one JSON object per line:
+    {"id": 1, "op": "verify", "gov_id": "<path>", "selfie": "<path>", "deadline_ms": 2000}
+    {"id": 2, "op": "verify_batch", "pairs": [["<gov_id>", "<selfie>"], ...]}
+    {"id": 3, "op": "verify_user", "gov_ids": ["<path>", ...], "selfies": ["<path>", ...]}
+    {"id": 4, "op": "health"}
+    {"id": 5, "op": "ready"}
+    {"id": 6, "op": "metrics"}
+    {"id": 7, "op": "profile", "count": 5}
+Each response is one JSON object per line carrying the same "id".
+
+Verify ops accept an optional "deadline_ms" budget. A request that cannot
+meet it on the full model runs on the light tier (--light-input-size) and is
+marked "degraded"; one that cannot meet it at all is rejected up front with
+"deadline_exceeded" (see load_shedding.py).
+
+"profile" captures cProfile, TensorFlow profiler and tracemalloc data for
+the next "count" verifications into --profile-dir (see profiling_hook.py).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from face_verification_pool import PreforkPool, configure_threads
+from verification_metrics import METRICS
+from load_shedding import DeadlineRouter
+from profiling_hook import PROFILE_DIR
+
+VERIFY_OPS = ('verify', 'verify_batch', 'verify_user')
+
+
+class FaceVerificationServer:
+    def __init__(self, pool=None, batch_window_ms=None, max_batch_size=16, light_input_size=None,
+                 profile_dir=PROFILE_DIR):
+        """Initialize the server; the model is loaded in the background"""
+        self.pool = pool
+        self.profile_dir = profile_dir
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self.light_input_size = light_input_size
+        self.batcher = None
+        self.watcher = None
+        self.verifier = None
+        self.tiers = {}
+        # Micro-batched requests share forward passes instead of waiting for each other
+        self.router = DeadlineRouter(
+            ('full', 'light') if light_input_size else ('full',), serial=batch_window_ms is None
+        )
+        self.load_error = None
+        self.started_at = time.time()
+        self.requests_served = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def load(self):
+        """Import TensorFlow and build the model once"""
+        try:
+            from face_verification_consistent import FaceVerificationSystem, get_backend, CASCADE_INPUT_SIZE
+            if self.batch_window_ms is None:
+                self.verifier = FaceVerificationSystem()
+            else:
+                from micro_batcher import MicroBatcher
+                self.batcher = MicroBatcher(get_backend(), self.max_batch_size, self.batch_window_ms)
+                screen = False
+                if CASCADE_INPUT_SIZE:
+                    # Requests run without the model lock, so the cascade's cheap stage is batched too
+                    screen = FaceVerificationSystem(
+                        backend=MicroBatcher(
+                            get_backend(input_size=CASCADE_INPUT_SIZE), self.max_batch_size, self.batch_window_ms
+                        ),
+                        screen=False,
+                        pipeline=False
+                    )
+                self.verifier = FaceVerificationSystem(backend=self.batcher, screen=screen)
+            self.tiers['full'] = self.verifier
+
+            if self.light_input_size:
+                # Same weights on a smaller input: a cheaper tier for requests short on time
+                light_backend = get_backend(input_size=self.light_input_size)
+                if self.batcher is not None:
+                    light_backend = MicroBatcher(light_backend, self.max_batch_size, self.batch_window_ms)
+                self.tiers['light'] = FaceVerificationSystem(
+                    backend=light_backend, screen=False, pipeline=self.verifier.pipeline or False
+                )
+            self._seed_router()
+        except Exception as e:
+            self.load_error = str(e)
+            print(f"Error loading face verification model: {e}", file=sys.stderr)
+        finally:
+            self._ready.set()
+
+    def _seed_router(self):
+        """Time one forward pass per tier, so deadline estimates start from a measurement"""
+        import numpy as np
+        for name, tier in self.tiers.items():
+            width, height = tier.target_size
+            dummy = np.zeros((1, height, width, 3), dtype=np.float32)
+            # The first call may still allocate buffers
+            tier.backend.predict(dummy)
+            started_at = time.perf_counter()
+            tier.backend.predict(dummy)
+            self.router.seed(name, time.perf_counter() - started_at)
+
+    def start_loading(self):
+        """Load the model on a background thread so health checks answer immediately"""
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def is_ready(self):
+        if self.pool is not None:
+            return self._ready.is_set() and any(worker.alive and worker.ready for worker in self.pool.workers)
+        return self._ready.is_set() and self.verifier is not None
+
+    def current_load_error(self):
+        """The model load error, or a worker's once no pool worker is left to serve"""
+        if self.load_error is None and self.pool is not None and not any(w.alive for w in self.pool.workers):
+            return next((worker.load_error for worker in self.pool.workers if worker.load_error), None)
+        return self.load_error
+
+    def health(self):
+        return {
+            "success": True,
+            "status": "ok",
+            "ready": self.is_ready(),
+            "load_error": self.current_load_error(),
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 3),
+            "requests_served": self.requests_served,
+            "cache": self.verifier.cache.stats() if self.verifier is not None and self.pool is None else None,
+            "phash": self.verifier.phash_index.stats()
+            if self.verifier is not None and self.pool is None and self.verifier.phash_index is not None else None,
+            "pool": self.pool.status() if self.pool is not None else None,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "precompute": self.watcher.stats() if self.watcher is not None else None,
+            "deadlines": self.router.stats(),
+            "pipeline": self.verifier.pipeline.stats()
+            if self.verifier is not None and self.pool is None and self.verifier.pipeline is not None else None,
+            "cascade": self.verifier.cascade_stats() if self.verifier is not None and self.pool is None else None
+        }
+
+    def verify(self, request):
+        gov_id_path = request.get('gov_id')
+        selfie_path = request.get('selfie')
+
+        if not gov_id_path or not selfie_path:
+            return {"success": False, "error": "Both image paths are required"}
+        if not os.path.exists(gov_id_path) or not os.path.exists(selfie_path):
+            return {"success": False, "error": "Image files not found"}
+
+        return self._run('verify_faces', gov_id_path, selfie_path, images=2, deadline_ms=request.get('deadline_ms'))
+
+    def verify_batch(self, request):
+        pairs = request.get('pairs') or []
+        if not pairs:
+            return {"success": False, "error": "At least one image pair is required"}
+        return self._run('verify_faces_batch', pairs, images=2 * len(pairs), deadline_ms=request.get('deadline_ms'))
+
+    def verify_user(self, request):
+        gov_ids = request.get('gov_ids') or []
+        selfies = request.get('selfies') or []
+        return self._run(
+            'verify_user_images', gov_ids, selfies,
+            images=len(gov_ids) + len(selfies), deadline_ms=request.get('deadline_ms')
+        )
+
+    def _deadline_exceeded(self, deadline_ms, ticket):
+        return {
+            "success": False,
+            "error": f"Verification cannot finish within the {deadline_ms} ms deadline",
+            "deadline_exceeded": True,
+            "estimated_ms": round(ticket.estimate * 1000, 3),
+            "match_score": 0.0,
+            "is_verified": False
+        }
+
+    def _run(self, method_name, *args, images=1, deadline_ms=None):
+        """Wait for the model, then run one verification call under the model lock"""
+        queued_at = time.perf_counter()
+        # bool is an int subclass, but true is not a deadline
+        if deadline_ms is not None and (
+            isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0
+        ):
+            return {"success": False, "error": "deadline_ms must be a positive number"}
+
+        ticket = self.router.admit(images, None if deadline_ms is None else deadline_ms / 1000)
+        if ticket.tier is None:
+            return self._deadline_exceeded(deadline_ms, ticket)
+
+        self._ready.wait()
+        if self.verifier is None:
+            self.router.cancel(ticket)
+            return {"success": False, "error": f"Model not loaded: {self.load_error}"}
+
+        # Keras models are not safe to call from several threads at once; the
+        # micro-batcher already funnels every forward pass through one thread
+        with self._lock if self.batcher is None else nullcontext():
+            queue_wait = time.perf_counter() - queued_at
+            tier = self.router.start(ticket)
+            if tier is None:
+                return self._deadline_exceeded(deadline_ms, ticket)
+            started_at = time.perf_counter()
+            try:
+                result = getattr(self.tiers[tier], method_name)(*args)
+            except Exception:
+                self.router.cancel(ticket)
+                raise
+            self.router.finish(ticket, time.perf_counter() - started_at)
+            self.requests_served += 1
+        if tier != 'full':
+            result['degraded'] = True
+            result['tier'] = tier
+        if 'timings' in result:
+            result['timings']['queue_wait_ms'] = round(queue_wait * 1000, 3)
+            METRICS.observe('queue_wait', queue_wait)
+        return result
+
+    def _submit(self, request):
+        """Run a verify op on the pool; workers keep their own registries, so aggregate here"""
+        submitted_at = time.perf_counter()
+        response = self.pool.submit(request)
+        self.requests_served += 1
+        timings = response.get('timings')
+        if timings:
+            elapsed_ms = (time.perf_counter() - submitted_at) * 1000
+            timings['queue_wait_ms'] = round(max(0.0, elapsed_ms - timings.get('total_ms', 0.0)), 3)
+            METRICS.record(timings, request.get('op', 'verify'))
+        return response
+
+    def metrics_gauges(self):
+        gauges = {"requests_served": self.requests_served, "ready": int(self.is_ready())}
+        if self.pool is not None:
+            gauges["pool_queued"] = self.pool.status()["queued"]
+        return gauges
+
+    def start_precompute(self, uploads_dir=None):
+        """Embed new uploads in the background as they land, sharing the loaded model"""
+        from embedding_precompute import UploadWatcher, UPLOADS_DIR
+
+        def start():
+            self._ready.wait()
+            if self.verifier is None:
+                return
+            self.watcher = UploadWatcher(
+                self.verifier,
+                uploads_dir=uploads_dir or UPLOADS_DIR,
+                lock=self._lock if self.batcher is None else None
+            )
+            self.watcher.start()
+
+        threading.Thread(target=start, daemon=True).start()
+
+    def start_metrics_writer(self, path, interval):
+        """Periodically write the metrics for a node_exporter textfile collector"""
+        def write_loop():
+            while True:
+                try:
+                    METRICS.write_textfile(path, self.metrics_gauges())
+                except OSError as e:
+                    print(f"Error writing metrics file {path}: {e}", file=sys.stderr)
+                time.sleep(interval)
+
+        threading.Thread(target=write_loop, daemon=True).start()
+
+    def profile(self, request):
+        """Profile the next `count` verifications on every tier (see profiling_hook.py)"""
+        if self.pool is not None:
+            return {"success": False, "error": "Profiling is not available with --workers"}
+        if not self.is_ready():
+            return {"success": False, "error": "Model is not loaded yet"}
+        count = request.get('count', 1)
+        if not isinstance(count, int) or count < 1:
+            return {"success": False, "error": "count must be a positive integer"}
+        for tier in self.tiers.values():
+            if tier.profiler is not None:
+                tier.profiler.stop()
+        capture = self.verifier.profile_next(count, self.profile_dir)
+        for tier in self.tiers.values():
+            tier.profiler = capture
+        return {"success": True, "profile": capture.status()}
+
+    def handle(self, request):
+        """Dispatch a single decoded request and return the response dict"""
+        op = request.get('op', 'verify')
+        if op == 'health':
+            response = self.health()
+        elif op == 'ready':
+            response = {"success": True, "ready": self.is_ready(), "load_error": self.current_load_error()}
+        elif op == 'metrics':
+            response = {"success": True, "metrics": METRICS.render(self.metrics_gauges())}
+        elif op == 'profile':
+            response = self.profile(request)
+        elif op in VERIFY_OPS and self.pool is not None:
+            response = self._submit(request)
+        elif op == 'verify':
+            response = self.verify(request)
+        elif op == 'verify_batch':
+            response = self.verify_batch(request)
+        elif op == 'verify_user':
+            response = self.verify_user(request)
+        else:
+            response = {"success": False, "error": f"Unknown op: {op}"}
+
+        if 'id' in request:
+            response['id'] = request['id']
+        return response
+
+    def handle_line(self, line):
+        """Decode one JSON line and return the encoded response line"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except ValueError as e:
+            return json.dumps({"success": False, "error": f"Invalid JSON input: {e}"})
+
+        try:
+            response = self.handle(request)
+        except Exception as e:
+            response = {"success": False, "error": str(e), "id": request.get('id')}
+        return json.dumps(response)
+
+    def start_pool(self):
+        """Load the model in this process, then fork the pool workers that share it"""
+        from face_verification_consistent import INFERENCE_BACKEND
+
+        # TensorFlow's eager runtime does not survive fork(), so Keras workers
+        # load their own model copy; the TFLite model is shared with the parent
+        share_model = INFERENCE_BACKEND != 'keras'
+        if share_model:
+            self.load()
+            if self.verifier is None:
+                raise RuntimeError(f"Model not loaded: {self.load_error}")
+
+        def init_worker():
+            self.pool = None
+            if not share_model:
+                self.load()
+            return self.load_error
+
+        self.pool.start(self.handle, init_worker=init_worker)
+        self._ready.set()
+
+    def serve_stdio(self):
+        """Serve JSON-lines requests on stdin, writing responses to stdout"""
+        if self.pool is None and self.batch_window_ms is None:
+            for line in sys.stdin:
+                line = line.strip()
+                if not line:
+                    continue
+                sys.stdout.write(self.handle_line(line) + "\n")
+                sys.stdout.flush()
+            return
+
+        # With a pool or micro-batching, requests run concurrently and responses
+        # may come back out of order
+        write_lock = threading.Lock()
+        concurrency = self.pool.num_workers * 2 if self.pool is not None else self.max_batch_size * 2
+
+        def respond(line):
+            response = self.handle_line(line)
+            with write_lock:
+                sys.stdout.write(response + "\n")
+                sys.stdout.flush()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    executor.submit(respond, line)
+
+    def serve_unix(self, socket_path):
+        """Serve JSON-lines requests on a local Unix socket"""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    line = raw.decode('utf-8').strip()
+                    if not line:
+                        continue
+                    self.wfile.write((server.handle_line(line) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            print(f"Face verification server listening on {socket_path}", file=sys.stderr)
+            try:
+                unix_server.serve_forever()
+            finally:
+                if os.path.exists(socket_path):
+                    os.unlink(socket_path)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Long-lived face verification server")
+    parser.add_argument('--socket', help="Unix socket path (default: JSON lines on stdin/stdout)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Number of pre-forked workers sharing one loaded model (default: serve in-process)")
+    parser.add_argument('--keras-workers', action='store_true',
+                        help="Allow --workers with the Keras backend, which loads one model copy per worker")
+    parser.add_argument('--intra-op-threads', type=int, default=1, help="TensorFlow intra-op threads per worker")
+    parser.add_argument('--inter-op-threads', type=int, default=1, help="TensorFlow inter-op threads per worker")
+    parser.add_argument('--batch-window-ms', type=float, default=None,
+                        help="Coalesce concurrent requests arriving within this window into one forward pass")
+    parser.add_argument('--max-batch-size', type=int, default=16, help="Largest coalesced forward pass")
+    parser.add_argument('--light-input-size', type=int, default=None,
+                        help="Input size of the cheaper tier used when a request's deadline_ms cannot be met")
+    parser.add_argument('--precompute-uploads', action='store_true',
+                        help="Embed new uploads in the background so verification only compares stored vectors")
+    parser.add_argument('--instrument', action='store_true',
+                        help="Add per-stage timings to results and collect metrics (FACE_INSTRUMENTATION=1)")
+    parser.add_argument('--metrics-file', help="Write Prometheus metrics to this file for a textfile collector")
+    parser.add_argument('--metrics-interval', type=float, default=15.0, help="Seconds between metrics file writes")
+    parser.add_argument('--profile-dir', default=PROFILE_DIR,
+                        help="Where the profile op writes its captures (FACE_PROFILE_DIR)")
+    args = parser.parse_args()
+
+    if args.instrument:
+        os.environ['FACE_INSTRUMENTATION'] = '1'
+    if args.workers > 0 and args.batch_window_ms is not None:
+        parser.error("--batch-window-ms serves the model in-process and cannot be combined with --workers")
+    if args.workers > 0 and args.light_input_size:
+        parser.error("--light-input-size serves the model in-process and cannot be combined with --workers")
+    if args.workers > 0 and args.precompute_uploads:
+        parser.error("--precompute-uploads serves the model in-process and cannot be combined with --workers")
+
+    if args.workers > 0:
+        configure_threads(args.intra_op_threads, args.inter_op_threads)
+        from face_verification_consistent import INFERENCE_BACKEND
+        if INFERENCE_BACKEND == 'keras' and not args.keras_workers:
+            parser.error("--workers with the Keras backend loads a model copy in every worker; "
+                         "set FACE_INFERENCE_BACKEND=tflite to share one model, or pass --keras-workers")
+        server = FaceVerificationServer(pool=PreforkPool(
+            args.workers,
+            intra_op_threads=args.intra_op_threads,
+            inter_op_threads=args.inter_op_threads
+        ))
+        # Fork before any server thread starts
+        server.start_pool()
+    else:
+        server = FaceVerificationServer(
+            batch_window_ms=args.batch_window_ms,
+            max_batch_size=args.max_batch_size,
+            light_input_size=args.light_input_size,
+            profile_dir=args.profile_dir
+        )
+        server.start_loading()
+        if args.precompute_uploads:
+            server.start_precompute()
+
+    if args.metrics_file:
+        server.start_metrics_writer(args.metrics_file, args.metrics_interval)
+
+    if args.socket:
+        server.serve_unix(args.socket)
+    else:
+        server.serve_stdio()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Length-prefixed binary protocol for passing raw image bytes over stdin/stdout.
+
+Request:
+    b"FVB1"                     4-byte magic
+    uint32 (big-endian)         header length
+    header                      UTF-8 JSON, e.g. {"op": "verify", "images": ["gov_id", "selfie"]}
+    for each name in "images":
+        uint32 (big-endian)     image length
+        image                   raw encoded image bytes (JPEG/PNG)
+
+Response:
+    b"FVB1"                     4-byte magic
+    uint32 (big-endian)         payload length
+    payload                     UTF-8 JSON result
+"""
+
+import json
+import struct
+
+MAGIC = b'FVB1'
+MAX_HEADER_BYTES = 64 * 1024
+MAX_IMAGE_BYTES = 32 * 1024 * 1024
+
+
+def _read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError(f"Unexpected end of stream ({len(data)} of {size} bytes)")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _read_length(stream, limit, what):
+    (length,) = struct.unpack('>I', _read_exact(stream, 4))
+    if length > limit:
+        raise ValueError(f"{what} too large: {length} bytes")
+    return length
+
+
+def read_request(stream):
+    """Read one framed request; returns (header dict, {name: bytes}) or None at end of stream"""
+    magic = stream.read(len(MAGIC))
+    if not magic:
+        return None
+    # A pipe may deliver the magic in pieces; only a clean end before it means no request
+    magic += _read_exact(stream, len(MAGIC) - len(magic))
+    if magic != MAGIC:
+        raise ValueError("Invalid frame magic")
+
+    header = json.loads(_read_exact(stream, _read_length(stream, MAX_HEADER_BYTES, "Header")))
+    if not isinstance(header, dict):
+        raise ValueError("Header must be a JSON object")
+
+    names = header.get('images', [])
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError("Header images must be a list of names")
+
+    images = {}
+    for name in names:
+        images[name] = _read_exact(stream, _read_length(stream, MAX_IMAGE_BYTES, "Image"))
+    return header, images
+
+
+def write_response(stream, result):
+    """Write one framed JSON response and flush it"""
+    payload = json.dumps(result).encode('utf-8')
+    stream.write(MAGIC + struct.pack('>I', len(payload)) + payload)
+    stream.flush()
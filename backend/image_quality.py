@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Pre-inference image quality gate.
+
+Runs on a downscaled grayscale copy of the decoded image and rejects inputs
+that cannot verify anyway (too dark, overexposed, badly blurred or without a
+detectable face) before the embedding model runs. Checks run cheapest first;
+the Haar cascade is loaded once and then reused. The face box found here is
+mapped back to the decoded image so that the engine can crop to the face.
+
+Thresholds are deliberately loose: the gate only stops clearly unusable
+uploads, everything borderline still goes to the model.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+QUALITY_MAX_SIDE = 480
+# Images are decoded with both sides at least this large before the gate and face
+# detection run, whatever the model input size, so small ID photos stay detectable
+DETECTION_MIN_SIDE = 299
+MIN_BRIGHTNESS = 40.0
+MAX_BRIGHTNESS = 225.0
+# Variance of the Laplacian at QUALITY_MAX_SIDE; sharp uploads score in the hundreds
+MIN_SHARPNESS = 10.0
+MIN_FACE_SIZE = 24
+# Context kept around the detected face box, as a fraction of its size per side
+FACE_CROP_MARGIN = 0.4
+
+# Gov-ID cards are often photographed sideways, so upright is tried first,
+# then both quarter turns
+ROTATIONS = (
+    (0, None),
+    (90, cv2.ROTATE_90_CLOCKWISE),
+    (270, cv2.ROTATE_90_COUNTERCLOCKWISE),
+)
+
+_detectors = threading.local()
+
+
+class ImageQualityError(ValueError):
+    def __init__(self, reason, message, metrics):
+        """An image the quality gate rejected; reason is a stable machine-readable code"""
+        super().__init__(f"Image rejected: {message}")
+        self.reason = reason
+        self.metrics = metrics
+        self.image = None
+
+    def as_dict(self):
+        rejection = {"image": self.image} if self.image else {}
+        rejection.update({"reason": self.reason, **self.metrics})
+        return rejection
+
+
+def face_detector(name='haarcascade_frontalface_default.xml'):
+    """Haar cascade, loaded once per thread; cascade objects are not safe to share between threads"""
+    detectors = _detectors.__dict__
+    if name not in detectors:
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+        if detector.empty():
+            raise ValueError(f"Could not load face detector: {name}")
+        detectors[name] = detector
+    return detectors[name]
+
+
+def gray_thumbnail(img, max_side=QUALITY_MAX_SIDE):
+    """Grayscale copy of a decoded BGR image with its longest side at most max_side.
+
+    Returns (thumbnail, scale) where scale maps thumbnail coordinates back to img.
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    scale = max(gray.shape[:2]) / max_side
+    if scale <= 1:
+        return gray, 1.0
+    size = (round(gray.shape[1] / scale), round(gray.shape[0] / scale))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), scale
+
+
+def detect_faces(gray, min_size=MIN_FACE_SIZE):
+    """(rotation in degrees, face boxes in the rotated frame) for the first orientation with a face"""
+    detector = face_detector()
+    for degrees, rotate_code in ROTATIONS:
+        rotated = gray if rotate_code is None else cv2.rotate(gray, rotate_code)
+        faces = detector.detectMultiScale(rotated, 1.3, 3, minSize=(min_size, min_size))
+        if len(faces):
+            return degrees, faces
+    return None, ()
+
+
+def largest_face(gray):
+    """(rotation, (x, y, w, h)) of the largest face in gray's own, unrotated frame, or (None, None)"""
+    rotation, faces = detect_faces(gray)
+    if rotation is None:
+        return None, None
+    x, y, w, h = (int(v) for v in max(faces, key=lambda box: box[2] * box[3]))
+    height, width = gray.shape[:2]
+    if rotation == 90:
+        # Rotated clockwise: rotated column x is unrotated row height - 1 - x
+        x, y, w, h = y, height - x - w, h, w
+    elif rotation == 270:
+        x, y, w, h = width - y - h, x, h, w
+    return rotation, (x, y, w, h)
+
+
+def locate_face(img):
+    """(rotation, face box in img coordinates) of the largest face, or (None, None)"""
+    gray, scale = gray_thumbnail(img)
+    rotation, box = largest_face(gray)
+    if box is None:
+        return None, None
+    return rotation, [round(v * scale) for v in box]
+
+
+def crop_face(img, rotation, box, margin=FACE_CROP_MARGIN):
+    """Crop img to box plus margin on each side, turned so the face is upright"""
+    x, y, w, h = box
+    pad_x, pad_y = round(w * margin), round(h * margin)
+    top, bottom = max(0, y - pad_y), min(img.shape[0], y + h + pad_y)
+    left, right = max(0, x - pad_x), min(img.shape[1], x + w + pad_x)
+    crop = img[top:bottom, left:right]
+    rotate_code = dict(ROTATIONS)[rotation]
+    return crop if rotate_code is None else cv2.rotate(crop, rotate_code)
+
+
+def check_quality(img):
+    """Brightness, blur and face-presence checks; raises ImageQualityError on a clearly bad image.
+
+    Returns the measurements, including the face rotation and box in img coordinates.
+    """
+    gray, scale = gray_thumbnail(img)
+    metrics = {"brightness": round(float(np.mean(gray)), 1)}
+    if metrics["brightness"] < MIN_BRIGHTNESS:
+        raise ImageQualityError(
+            'too_dark', f"image is too dark (brightness {metrics['brightness']} < {MIN_BRIGHTNESS})", metrics
+        )
+    if metrics["brightness"] > MAX_BRIGHTNESS:
+        raise ImageQualityError(
+            'too_bright', f"image is overexposed (brightness {metrics['brightness']} > {MAX_BRIGHTNESS})", metrics
+        )
+
+    metrics["sharpness"] = round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 1)
+    if metrics["sharpness"] < MIN_SHARPNESS:
+        raise ImageQualityError(
+            'blurry', f"image is too blurry (sharpness {metrics['sharpness']} < {MIN_SHARPNESS})", metrics
+        )
+
+    rotation, box = largest_face(gray)
+    if box is None:
+        raise ImageQualityError('no_face', "no face detected", metrics)
+    metrics["rotation"] = rotation
+    metrics["face_box"] = [round(v * scale) for v in box]
+    return metrics
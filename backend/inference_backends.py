@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Inference backends for the face embedding model.
+
+FaceVerificationSystem calls backend.predict(batch) and does not care whether
+the embeddings come from the Keras model or from a quantized TFLite
+interpreter. Backends are chosen by FACE_INFERENCE_BACKEND (keras or tflite)
+and, for TFLite, FACE_TFLITE_QUANTIZATION (dynamic, float16 or int8).
+"""
+
+import os
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATION_MODES = ('dynamic', 'float16', 'int8')
+
+
+def compile_predict(model, jit_compile=False):
+    """Graph-compiled forward pass with a fixed (None, H, W, 3) float32 input signature.
+
+    Calling it skips the data adapter and loop machinery that model.predict
+    sets up on every call. jit_compile additionally compiles the graph with
+    XLA, once per distinct batch size.
+    """
+    signature = tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32)
+
+    @tf.function(input_signature=[signature], jit_compile=jit_compile)
+    def predict(img_batch):
+        return model(img_batch, training=False)
+
+    return predict
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, model, version, compiled=True, jit_compile=False, warmup_batch_sizes=(1, 2)):
+        """Float32 inference through the Keras model.
+
+        With compiled=True the forward pass runs through compile_predict and is
+        traced (and XLA-compiled) here, at load, rather than on the first request.
+        """
+        self.model = model
+        self.version = version
+        self.input_size = (model.input_shape[2], model.input_shape[1])
+        self.compiled = compiled
+        self.jit_compile = jit_compile
+        self._predict_fn = compile_predict(model, jit_compile) if compiled else None
+        if compiled:
+            self.warm_up(warmup_batch_sizes)
+
+    def warm_up(self, batch_sizes=(1,)):
+        shape = tuple(self.model.input_shape[1:])
+        for batch_size in batch_sizes:
+            self.predict(np.zeros((batch_size,) + shape, dtype=np.float32))
+
+    def predict(self, img_batch):
+        if self._predict_fn is None:
+            return self.model.predict(img_batch, verbose=0)
+        return self._predict_fn(tf.convert_to_tensor(img_batch, dtype=tf.float32)).numpy()
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, model_path, version, num_threads=None, input_size=None):
+        """Inference through a (quantized) TFLite flatbuffer; input_size resizes the square model input"""
+        if not os.path.exists(model_path):
+            raise ValueError(
+                f"TFLite model not found: {model_path}. "
+                "Build it with: python build_face_model.py --tflite <mode>"
+            )
+        self.model = None
+        self.model_path = model_path
+        self.version = version
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_details['shape'][0])
+        if input_size is not None and input_size != int(self.input_details['shape'][1]):
+            self.interpreter.resize_tensor_input(
+                self.input_details['index'], [self._batch_size, input_size, input_size, 3]
+            )
+            self.interpreter.allocate_tensors()
+            self.input_details = self.interpreter.get_input_details()[0]
+            self.output_details = self.interpreter.get_output_details()[0]
+        self.input_size = (int(self.input_details['shape'][2]), int(self.input_details['shape'][1]))
+
+    def _resize(self, batch_size):
+        if batch_size == self._batch_size:
+            return
+        shape = list(self.input_details['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_details['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, img_batch):
+        self._resize(len(img_batch))
+
+        input_dtype = self.input_details['dtype']
+        if input_dtype == np.float32:
+            tensor = np.ascontiguousarray(img_batch, dtype=np.float32)
+        else:
+            # Full-integer model: quantize the [-1, 1] input with the tensor's own scale
+            scale, zero_point = self.input_details['quantization']
+            info = np.iinfo(input_dtype)
+            tensor = np.clip(np.round(img_batch / scale + zero_point), info.min, info.max).astype(input_dtype)
+
+        self.interpreter.set_tensor(self.input_details['index'], tensor)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_details['index'])
+
+        if self.output_details['dtype'] != np.float32:
+            scale, zero_point = self.output_details['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def convert_to_tflite(model, output_path, quantization='dynamic', representative_batches=None):
+    """Convert a Keras model to a TFLite flatbuffer with the given quantization mode.
+
+    representative_batches is a callable returning an iterable of float32
+    (1, 299, 299, 3) arrays; it is required for int8 calibration.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if representative_batches is None:
+            raise ValueError("int8 quantization needs a representative dataset")
+        converter.representative_dataset = lambda: ([batch] for batch in representative_batches())
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    flatbuffer = converter.convert()
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, output_path)
+    return output_path
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Deadline-aware tier selection for the face verification server.
+
+Requests may carry a deadline. The router keeps an exponentially weighted
+per-image latency for each model tier and the estimated cost of the work
+already admitted. A request goes to the best tier that can still finish in
+time, to a cheaper tier (marked degraded) when the full one cannot, and is
+rejected up front when no tier can.
+
+An estimate only moves when a request finishes, and rejected requests never
+run. One slow sample would therefore shed load forever. Instead, without new
+samples an estimate decays back toward its tier's floor, the warm-up
+measurement the server seeds it with, so requests are admitted again and
+refresh it. A tier with no samples of its own borrows the nearest measured
+tier's estimate. With nothing measured, the cost is unknown and requests
+with a deadline are rejected rather than assumed free.
+"""
+
+import time
+import threading
+
+# Weight of the newest sample in the per-image latency average
+LATENCY_SMOOTHING = 0.2
+# Seconds for an estimate's excess over its floor to halve without new samples
+LATENCY_HALF_LIFE = 10.0
+
+
+class Ticket:
+    def __init__(self, images, deadline):
+        """One admitted request; deadline is an absolute time.perf_counter() value or None"""
+        self.images = images
+        self.deadline = deadline
+        self.tier = None
+        self.cost = 0.0
+        self.estimate = 0.0
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.perf_counter()
+
+
+class DeadlineRouter:
+    def __init__(self, tiers=('full',), serial=True):
+        """tiers are ordered from the most accurate to the cheapest.
+
+        serial means requests run one after another, so each waits for the
+        admitted backlog. When they are batched together, it is not charged.
+        """
+        self.tiers = list(tiers)
+        self.serial = serial
+        self.per_image = {tier: None for tier in self.tiers}
+        self.floor = {tier: 0.0 for tier in self.tiers}
+        self.sampled_at = {tier: None for tier in self.tiers}
+        self.backlog = 0.0
+        self.in_flight = 0
+        self.served = {tier: 0 for tier in self.tiers}
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _decayed(self, tier, now):
+        value = self.per_image[tier]
+        if value is None:
+            return None
+        floor = min(self.floor[tier], value)
+        return floor + (value - floor) * 0.5 ** ((now - self.sampled_at[tier]) / LATENCY_HALF_LIFE)
+
+    def per_image_estimate(self, tier, now=None):
+        """Expected seconds per image on tier, or None while no tier has been measured"""
+        now = time.perf_counter() if now is None else now
+        position = self.tiers.index(tier)
+        # Prefer the tier itself, then the closest measured neighbour, more accurate ones first
+        for distance in range(len(self.tiers)):
+            for other in (position - distance, position + distance):
+                if 0 <= other < len(self.tiers):
+                    value = self._decayed(self.tiers[other], now)
+                    if value is not None:
+                        return value
+        return None
+
+    def estimate(self, tier, images):
+        """Expected service time in seconds, or None when it is unknown"""
+        per_image = self.per_image_estimate(tier)
+        return None if per_image is None else per_image * images
+
+    def _choose(self, ticket, backlog):
+        remaining = ticket.remaining()
+        if remaining is None:
+            return self.tiers[0]
+        for tier in self.tiers:
+            estimate = self.estimate(tier, ticket.images)
+            if estimate is None:
+                continue
+            ticket.estimate = (backlog if self.serial else 0.0) + estimate
+            if ticket.estimate <= remaining:
+                return tier
+        return None
+
+    def _charge(self, ticket, tier):
+        cost = self.estimate(tier, ticket.images) or 0.0
+        self.backlog += cost - ticket.cost
+        ticket.cost = cost
+        ticket.tier = tier
+
+    def admit(self, images, deadline_s=None):
+        """Ticket for a new request; ticket.tier is None when it cannot meet its deadline on any tier"""
+        ticket = Ticket(images, None if deadline_s is None else time.perf_counter() + deadline_s)
+        with self._lock:
+            tier = self._choose(ticket, self.backlog)
+            if tier is None:
+                self.rejected += 1
+                return ticket
+            self._charge(ticket, tier)
+            self.in_flight += 1
+        return ticket
+
+    def start(self, ticket):
+        """Re-pick the tier once the request reaches the model; None means it is too late for any tier"""
+        with self._lock:
+            tier = self._choose(ticket, 0.0)
+            if tier is None:
+                self.rejected += 1
+                self._release(ticket)
+                return None
+            self._charge(ticket, tier)
+            return tier
+
+    def _release(self, ticket):
+        self.backlog = max(0.0, self.backlog - ticket.cost)
+        self.in_flight -= 1
+        ticket.cost = 0.0
+
+    def seed(self, tier, seconds_per_image):
+        """Start tier's estimate from a warm-up measurement, which is also the floor it decays to"""
+        with self._lock:
+            self.floor[tier] = seconds_per_image
+            if self.per_image[tier] is None:
+                self.per_image[tier] = seconds_per_image
+                self.sampled_at[tier] = time.perf_counter()
+
+    def finish(self, ticket, seconds):
+        """Record the measured service time of a request that ran on ticket.tier"""
+        with self._lock:
+            self._release(ticket)
+            now = time.perf_counter()
+            sample = seconds / max(1, ticket.images)
+            previous = self._decayed(ticket.tier, now)
+            self.per_image[ticket.tier] = sample if previous is None else (
+                previous + LATENCY_SMOOTHING * (sample - previous)
+            )
+            self.sampled_at[ticket.tier] = now
+            self.served[ticket.tier] += 1
+
+    def cancel(self, ticket):
+        """Drop an admitted request that never ran"""
+        with self._lock:
+            self._release(ticket)
+
+    def stats(self):
+        with self._lock:
+            now = time.perf_counter()
+            return {
+                "tiers": self.tiers,
+                "serial": self.serial,
+                "per_image_ms": {
+                    tier: None if self.per_image[tier] is None else round(self._decayed(tier, now) * 1000, 3)
+                    for tier in self.tiers
+                },
+                "backlog_ms": round(self.backlog * 1000, 3),
+                "in_flight": self.in_flight,
+                "served": dict(self.served),
+                "rejected": self.rejected
+            }
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching in front of an inference backend.
+
+Concurrent callers each hand over a small batch (usually one image). An
+asyncio scheduler collects them for up to max_wait_ms or until max_batch_size
+rows are waiting, runs one stacked backend.predict and scatters the embedding
+rows back to the callers. A MicroBatcher has the same interface as the
+backends in inference_backends.py, so FaceVerificationSystem uses it
+unchanged; the wrapped model is only ever called from the scheduler's single
+inference thread.
+
+Used by face_verification_server.py --batch-window-ms N.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class MicroBatcher:
+    def __init__(self, backend, max_batch_size=16, max_wait_ms=5.0):
+        """Wrap backend; the scheduler runs on its own event loop thread"""
+        self.backend = backend
+        self.name = backend.name
+        self.model = backend.model
+        self.version = backend.version
+        self.input_size = backend.input_size
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+
+        self._inference = ThreadPoolExecutor(max_workers=1, thread_name_prefix='face-inference')
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        threading.Thread(target=self._run_loop, daemon=True).start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._loop.create_task(self._schedule())
+        self._started.set()
+        self._loop.run_forever()
+
+    async def embed(self, img_batch):
+        """Embeddings for img_batch, computed in a forward pass shared with other callers"""
+        future = self._loop.create_future()
+        await self._queue.put((np.asarray(img_batch, dtype=np.float32), future))
+        return await future
+
+    def predict(self, img_batch):
+        """Blocking entry point for caller threads outside the event loop"""
+        return asyncio.run_coroutine_threadsafe(self.embed(img_batch), self._loop).result()
+
+    async def _collect(self, first):
+        """Pending requests starting with first, until the window closes or the batch is full"""
+        pending = [first]
+        rows = len(first[0])
+        deadline = self._loop.time() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if rows + len(item[0]) > self.max_batch_size:
+                # Leave the overflow to open the next batch
+                self._carry = item
+                break
+            pending.append(item)
+            rows += len(item[0])
+        return pending
+
+    async def _schedule(self):
+        self._carry = None
+        while True:
+            first, self._carry = self._carry, None
+            if first is None:
+                first = await self._queue.get()
+            pending = await self._collect(first)
+
+            stacked = np.concatenate([img_batch for img_batch, _ in pending])
+            try:
+                embeddings = await self._loop.run_in_executor(self._inference, self.backend.predict, stacked)
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.rows += len(stacked)
+            self.largest_batch = max(self.largest_batch, len(stacked))
+            offset = 0
+            for img_batch, future in pending:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(img_batch)])
+                offset += len(img_batch)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch
+        }
@@ -122,6 +122,7 @@ const userSchema = new mongoose.Schema({
             default: 'not_submitted'
         },
         matchScore: Number, // Face match score (0-1)
+        degraded: Boolean, // Scored by the lighter model tier to meet a deadline
         submittedAt: Date,
         verifiedAt: Date,
         adminReviewedAt: Date,
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Bounded thread pool that overlaps image preprocessing with inference.
+
+Reading, decoding, face detection and resizing run in OpenCV and NumPy, and
+both release the GIL. A few worker threads can therefore prepare upcoming
+images while the calling thread runs the model on the current ones. `map`
+keeps at most `prefetch` tasks submitted ahead of the consumer. A slow
+consumer stalls the producers instead of letting prepared batches pile up
+in memory.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PreprocessPipeline:
+    def __init__(self, workers=2, prefetch=4):
+        """workers threads run the tasks; prefetch bounds how far ahead of the consumer they may get"""
+        if workers < 1 or prefetch < 1:
+            raise ValueError("Preprocess pipeline needs at least one worker and a prefetch depth of at least one")
+        self.workers = workers
+        self.prefetch = prefetch
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='preprocess')
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.stalls = 0
+
+    def _run(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on a worker; returns a Future"""
+        with self._lock:
+            self.in_flight += 1
+        return self._executor.submit(self._run, fn, *args)
+
+    def map(self, fn, items):
+        """Yield fn(item) for each item in order, keeping at most prefetch calls ahead of the consumer.
+
+        Exceptions raised by fn are re-raised when their result is reached.
+        """
+        pending = deque()
+        items = iter(items)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.prefetch:
+                    try:
+                        pending.append(self.submit(fn, next(items)))
+                    except StopIteration:
+                        exhausted = True
+                if not pending:
+                    return
+                future = pending.popleft()
+                if not future.done():
+                    # The consumer outran the workers
+                    with self._lock:
+                        self.stalls += 1
+                yield future.result()
+        finally:
+            # Abandoned early: drop work that has not started yet
+            for future in pending:
+                if future.cancel():
+                    with self._lock:
+                        self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "prefetch": self.prefetch,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "stalls": self.stalls
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of face verification calls.
+
+Arming a verifier with a ProfileCapture profiles its next N verification
+calls. The capture records:
+- a cProfile dump of the Python side, for decode, preprocessing and
+  framework overhead
+- a TensorFlow profiler trace of op scheduling and kernel time, for
+  TensorBoard
+- a tracemalloc snapshot of the allocations made while it ran
+
+Everything is written to a timestamped directory for offline analysis.
+Arming a new capture first stops an unfinished one and writes what it has.
+While no capture is armed, a profiled method costs one attribute check.
+
+    python face_verification_consistent.py gov.jpg selfie.jpg --profile profiles/
+    {"op": "profile", "count": 5}      # control message to face_verification_server.py
+
+Open the results with `python -m pstats calls.prof`,
+`tensorboard --logdir tf_trace` and `tracemalloc.Snapshot.load('memory.snapshot')`.
+"""
+
+import os
+import json
+import time
+import cProfile
+import functools
+import threading
+import tracemalloc
+
+PROFILE_DIR = os.environ.get(
+    'FACE_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+)
+# Stack depth kept per allocation; deeper traces cost more while the capture runs
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 20
+
+
+def profiled(method):
+    """Run a verifier method under its armed capture, if any"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        capture = self.profiler
+        if capture is None:
+            return method(self, *args, **kwargs)
+        result = capture.run(method.__name__, method, self, *args, **kwargs)
+        if capture.finished:
+            self.profiler = None
+        return result
+    return wrapper
+
+
+class ProfileCapture:
+    def __init__(self, count=1, output_dir=PROFILE_DIR, tf_trace=True, memory=True):
+        """Profile the next count verification calls into a new directory under output_dir"""
+        if count < 1:
+            raise ValueError("Profile count must be at least 1")
+        self.count = count
+        now = time.time()
+        # Milliseconds keep a capture re-armed within the same second in its own directory
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f"{now % 1:.3f}"[1:]
+        self.output_dir = os.path.join(os.path.abspath(output_dir), f"{stamp}-{os.getpid()}")
+        self.tf_trace = tf_trace
+        self.memory = memory
+        self.calls = []
+        self.errors = []
+        self.finished = False
+        self._profile = cProfile.Profile()
+        self._lock = threading.Lock()
+        self._started = False
+        self._started_tracemalloc = False
+
+    def _start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        if self.tf_trace:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.start(os.path.join(self.output_dir, 'tf_trace'))
+            except Exception as e:
+                self.tf_trace = False
+                self.errors.append(f"TensorFlow profiler unavailable: {e}")
+        self._started = True
+
+    def run(self, operation, method, *args, **kwargs):
+        """Call method under the profilers; concurrent calls run unprofiled while one is captured"""
+        if not self._lock.acquire(blocking=False):
+            return method(*args, **kwargs)
+        try:
+            if self.finished:
+                return method(*args, **kwargs)
+            if not self._started:
+                self._start()
+            start = time.perf_counter()
+            self._profile.enable()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._profile.disable()
+                self.calls.append({"operation": operation, "seconds": round(time.perf_counter() - start, 6)})
+                if len(self.calls) >= self.count:
+                    self._write()
+        finally:
+            self._lock.release()
+
+    def stop(self):
+        """Finish early: stop the profilers and write what was captured so far"""
+        # Waits for a call being captured to return
+        with self._lock:
+            if self.finished:
+                return
+            if not self._started:
+                self.finished = True
+                return
+            self.errors.append(f"Stopped after {len(self.calls)} of {self.count} calls")
+            self._write()
+
+    def _write(self):
+        self.finished = True
+        if self.tf_trace:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.stop()
+            except Exception as e:
+                self.errors.append(f"Could not stop the TensorFlow profiler: {e}")
+        self._profile.dump_stats(os.path.join(self.output_dir, 'calls.prof'))
+
+        top_allocations = []
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(os.path.join(self.output_dir, 'memory.snapshot'))
+            # The profilers' own bookkeeping would otherwise top the list
+            filtered = snapshot.filter_traces([
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            ])
+            top_allocations = [str(stat) for stat in filtered.statistics('lineno')[:TOP_ALLOCATIONS]]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w') as f:
+            json.dump({
+                "calls": self.calls,
+                "tf_trace": os.path.join(self.output_dir, 'tf_trace') if self.tf_trace else None,
+                "top_allocations": top_allocations,
+                "errors": self.errors
+            }, f, indent=2)
+
+    def status(self):
+        return {
+            "output_dir": self.output_dir,
+            "requested": self.count,
+            "captured": len(self.calls),
+            "finished": self.finished
+        }
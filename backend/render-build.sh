@@ -15,3 +15,9 @@ if [ -f requirements.txt ]; then
   python3 -m pip install --upgrade pip
   python3 -m pip install -r requirements.txt
 fi
+
+# Build the frozen face embedding model once so the server never builds it at startup
+if [ -f build_face_model.py ]; then
+  echo "Building face embedding model artifact..."
+  python3 build_face_model.py
+fi
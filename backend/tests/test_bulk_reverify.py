@@ -0,0 +1,42 @@
+import json
+
+from bulk_reverify import load_checkpoint
+
+
+def record(gov_id, success=True, model_version='v1', threshold=0.7):
+    return {"gov_id": gov_id, "selfie": gov_id + '-selfie', "success": success,
+            "model_version": model_version, "threshold": threshold}
+
+
+def write_lines(path, records, tail=''):
+    path.write_text(''.join(json.dumps(r) + '\n' for r in records) + tail)
+
+
+def test_missing_output_has_nothing_done(tmp_path):
+    assert load_checkpoint(str(tmp_path / 'out.jsonl')) == set()
+
+
+def test_failed_records_are_retried(tmp_path):
+    out = tmp_path / 'out.jsonl'
+    write_lines(out, [record('a'), record('b', success=False)])
+    assert load_checkpoint(str(out)) == {('a', 'a-selfie', 'v1', 0.7)}
+
+
+def test_retried_pair_counts_once_it_succeeds(tmp_path):
+    out = tmp_path / 'out.jsonl'
+    write_lines(out, [record('b', success=False), record('b')])
+    assert load_checkpoint(str(out)) == {('b', 'b-selfie', 'v1', 0.7)}
+
+
+def test_records_keep_their_model_version_and_threshold(tmp_path):
+    out = tmp_path / 'out.jsonl'
+    write_lines(out, [record('a', model_version='v0'), record('a', threshold=0.8)])
+    assert load_checkpoint(str(out)) == {('a', 'a-selfie', 'v0', 0.7), ('a', 'a-selfie', 'v1', 0.8)}
+
+
+def test_partial_trailing_line_is_truncated(tmp_path):
+    out = tmp_path / 'out.jsonl'
+    write_lines(out, [record('a')], tail='{"gov_id": "b", "sel')
+    assert load_checkpoint(str(out)) == {('a', 'a-selfie', 'v1', 0.7)}
+    assert out.read_text().endswith('\n')
+    assert '"b"' not in out.read_text()
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+
+from embedding_cache import SIDECAR_DIR, EmbeddingCache
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+def test_keys_depend_on_content_and_model_version():
+    cache = EmbeddingCache('v1')
+    assert cache.key(b'image') == cache.key(b'image')
+    assert cache.key(b'image') != cache.key(b'other')
+    assert cache.key(b'image') != EmbeddingCache('v2').key(b'image')
+    assert cache.key(b'image') == cache.key_for_digest(EmbeddingCache.content_digest(b'image'))
+
+
+def test_memory_lru_evicts_the_least_recently_used():
+    cache = EmbeddingCache('v1', max_entries=2)
+    keys = [cache.key(bytes([i])) for i in range(3)]
+    cache.put(keys[0], embedding(0))
+    cache.put(keys[1], embedding(1))
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], embedding(2))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_disk_layer_survives_a_new_cache(tmp_path):
+    key = EmbeddingCache('v1').key(b'image')
+    EmbeddingCache('v1', cache_dir=str(tmp_path)).put(key, embedding(0))
+    reopened = EmbeddingCache('v1', max_entries=0, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(reopened.get(key), embedding(0))
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = EmbeddingCache('v1', max_entries=0, cache_dir=str(tmp_path))
+    key = cache.key(b'image')
+    cache.put(key, embedding(0))
+    path = os.path.join(str(tmp_path), key[:2], f"{key}.npy")
+    with open(path, 'wb') as f:
+        f.write(b'not an npy file')
+    assert cache.get(key) is None
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith('.tmp')]
+
+
+def test_sidecar_is_found_next_to_its_image(tmp_path):
+    img_path = str(tmp_path / 'selfie.jpg')
+    cache = EmbeddingCache('v1')
+    key = cache.key(b'image')
+    assert cache.get(key, img_path) is None
+    cache.put_sidecar(img_path, key, embedding(0))
+    assert cache.has_sidecar(img_path, key)
+    assert os.path.dirname(cache.sidecar_path(img_path, key)) == str(tmp_path / SIDECAR_DIR)
+    np.testing.assert_array_equal(EmbeddingCache('v1').get(key, img_path), embedding(0))
+    assert EmbeddingCache('v2').get(EmbeddingCache('v2').key(b'image'), img_path) is None
@@ -0,0 +1,101 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from embedding_index import EmbeddingIndex
+
+
+def unit(seed, dim=8):
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def build(path, n, dim=8, **kwargs):
+    index = EmbeddingIndex(str(path), dim=dim, initial_capacity=2, **kwargs)
+    for i in range(n):
+        index.add(f"user{i}", unit(i, dim))
+    return index
+
+
+def test_opening_a_missing_index_without_create_fails(tmp_path):
+    with pytest.raises(ValueError, match="No embedding index"):
+        EmbeddingIndex(str(tmp_path / 'missing'), create=False)
+    assert not (tmp_path / 'missing').exists()
+
+
+def test_search_returns_the_closest_ids_best_first(tmp_path):
+    index = build(tmp_path, 10)
+    matches = index.search(unit(3), k=3)
+    assert matches[0][0] == 'user3'
+    assert matches[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [score for _, score in matches] == sorted((score for _, score in matches), reverse=True)
+    assert index.search(unit(3), k=3, exclude={'user3'})[0][0] != 'user3'
+
+
+def test_chunked_and_float16_search_agree_with_the_full_scan(tmp_path):
+    full = build(tmp_path / 'f32', 50)
+    half = build(tmp_path / 'f16', 50, dtype='float16')
+    query = unit(99)
+    expected = [item_id for item_id, _ in full.search(query, k=5)]
+    assert [item_id for item_id, _ in full.search(query, k=5, chunk_size=7)] == expected
+    assert [item_id for item_id, _ in half.search(query, k=5)] == expected
+
+
+def test_flushed_index_reopens_with_the_same_rows(tmp_path):
+    index = build(tmp_path, 5, model_version='v1')
+    index.remove('user1')
+    index.flush()
+    reopened = EmbeddingIndex(str(tmp_path), create=False)
+    assert len(reopened) == 4
+    assert 'user1' not in reopened
+    assert reopened.model_version == 'v1'
+    for item_id in ('user0', 'user2', 'user3', 'user4'):
+        assert reopened.search(unit(int(item_id[4:])), k=1)[0][0] == item_id
+
+
+def test_manifest_holds_the_ids_and_count_together(tmp_path):
+    build(tmp_path, 3).flush()
+    with open(tmp_path / 'meta.json') as f:
+        meta = json.load(f)
+    assert meta['count'] == 3
+    assert meta['ids'] == ['user0', 'user1', 'user2']
+    assert not (tmp_path / 'ids.json').exists()
+
+
+def test_rows_added_after_the_last_flush_are_ignored_on_reopen(tmp_path):
+    index = build(tmp_path, 3)
+    index.flush()
+    # A crash after the vectors grew but before the manifest was replaced
+    for i in range(3, 6):
+        index.add(f"user{i}", unit(i))
+    index.vectors.flush()
+    reopened = EmbeddingIndex(str(tmp_path), create=False)
+    assert len(reopened) == 3
+    assert reopened.search(unit(2), k=1)[0][0] == 'user2'
+
+
+def test_index_without_a_manifest_id_map_still_opens(tmp_path):
+    index = build(tmp_path, 3)
+    index.flush()
+    with open(tmp_path / 'meta.json') as f:
+        meta = json.load(f)
+    with open(tmp_path / 'ids.json', 'w') as f:
+        json.dump(meta.pop('ids'), f)
+    with open(tmp_path / 'meta.json', 'w') as f:
+        json.dump(meta, f)
+    reopened = EmbeddingIndex(str(tmp_path), create=False)
+    assert reopened.ids == ['user0', 'user1', 'user2']
+    reopened.flush()
+    assert not os.path.exists(tmp_path / 'ids.json')
+
+
+def test_other_model_versions_and_settings_are_rejected(tmp_path):
+    build(tmp_path, 2, model_version='v1').flush()
+    with pytest.raises(ValueError, match="model version"):
+        EmbeddingIndex(str(tmp_path), model_version='v2')
+    with pytest.raises(ValueError, match="-d embeddings"):
+        EmbeddingIndex(str(tmp_path), dim=16)
+    with pytest.raises(ValueError, match="float32"):
+        EmbeddingIndex(str(tmp_path), dtype='float16')
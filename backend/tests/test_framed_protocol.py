@@ -0,0 +1,87 @@
+import io
+import json
+import struct
+
+import pytest
+
+from framed_protocol import MAGIC, MAX_HEADER_BYTES, MAX_IMAGE_BYTES, read_request, write_response
+
+
+def frame(header, *images):
+    body = header if isinstance(header, bytes) else json.dumps(header).encode('utf-8')
+    data = MAGIC + struct.pack('>I', len(body)) + body
+    for image in images:
+        data += struct.pack('>I', len(image)) + image
+    return data
+
+
+class Trickle(io.RawIOBase):
+    """A stream that returns at most one byte per read, like a slow pipe"""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.data.read(min(size, 1) if size > 0 else size)
+
+
+def test_request_round_trip_with_images():
+    header = {"op": "verify", "id": 7, "images": ["gov_id", "selfie"]}
+    stream = io.BytesIO(frame(header, b'\xff\xd8gov', b'') + frame({"op": "profile", "count": 2}))
+    assert read_request(stream) == (header, {"gov_id": b'\xff\xd8gov', "selfie": b''})
+    assert read_request(stream) == ({"op": "profile", "count": 2}, {})
+    assert read_request(stream) is None
+
+
+def test_short_reads_are_reassembled():
+    header = {"images": ["gov_id"]}
+    assert read_request(Trickle(frame(header, b'x' * 100))) == (header, {"gov_id": b'x' * 100})
+
+
+def test_empty_stream_is_end_of_input():
+    assert read_request(io.BytesIO(b'')) is None
+
+
+@pytest.mark.parametrize('cut', [2, 6, 10, -3])
+def test_truncated_frame_raises_eof(cut):
+    data = frame({"images": ["gov_id"]}, b'abcdef')
+    with pytest.raises(EOFError):
+        read_request(io.BytesIO(data[:cut]))
+
+
+def test_wrong_magic_is_rejected():
+    with pytest.raises(ValueError, match="magic"):
+        read_request(io.BytesIO(b'GET / HTTP/1.1\r\n'))
+
+
+def test_oversized_lengths_are_rejected_before_reading():
+    with pytest.raises(ValueError, match="Header too large"):
+        read_request(io.BytesIO(MAGIC + struct.pack('>I', MAX_HEADER_BYTES + 1)))
+    oversized_image = frame({"images": ["gov_id"]}) + struct.pack('>I', MAX_IMAGE_BYTES + 1)
+    with pytest.raises(ValueError, match="Image too large"):
+        read_request(io.BytesIO(oversized_image))
+
+
+@pytest.mark.parametrize('header', [b'not json', b'\xff\xfe', b'[1, 2]'])
+def test_malformed_headers_are_rejected(header):
+    with pytest.raises(ValueError):
+        read_request(io.BytesIO(frame(header)))
+
+
+@pytest.mark.parametrize('names', ["gov_id", [1], {"gov_id": 1}])
+def test_image_names_must_be_a_list_of_strings(names):
+    with pytest.raises(ValueError, match="list of names"):
+        read_request(io.BytesIO(frame({"images": names}, b'abc')))
+
+
+def test_response_is_framed_json():
+    stream = io.BytesIO()
+    write_response(stream, {"success": True, "match_score": 0.5})
+    data = stream.getvalue()
+    assert data[:4] == MAGIC
+    (length,) = struct.unpack('>I', data[4:8])
+    assert len(data) == 8 + length
+    assert json.loads(data[8:]) == {"success": True, "match_score": 0.5}
@@ -0,0 +1,96 @@
+import types
+
+import pytest
+
+import load_shedding
+from load_shedding import DeadlineRouter, LATENCY_HALF_LIFE
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(load_shedding, 'time', types.SimpleNamespace(perf_counter=lambda: now[0]))
+    return now
+
+
+def run(router, images, deadline_s, seconds):
+    ticket = router.admit(images, deadline_s)
+    if ticket.tier is None:
+        return None
+    tier = router.start(ticket)
+    router.finish(ticket, seconds)
+    return tier
+
+
+def test_unmeasured_router_rejects_deadlines_but_admits_requests_without_one(clock):
+    router = DeadlineRouter(('full', 'light'))
+    assert router.admit(1, 0.001).tier is None
+    assert router.admit(1, None).tier == 'full'
+
+
+def test_unmeasured_tier_borrows_the_nearest_measured_estimate(clock):
+    router = DeadlineRouter(('full', 'light'))
+    router.seed('full', 0.5)
+    assert router.estimate('light', 2) == pytest.approx(1.0)
+    assert router.admit(1, 0.001).tier is None
+
+
+def test_slow_sample_decays_back_to_the_floor(clock):
+    router = DeadlineRouter(('full',))
+    router.seed('full', 0.1)
+    assert run(router, 1, 5.0, 1.24 / 0.2) == 'full'
+    assert router.admit(1, 0.5).tier is None
+
+    clock[0] += 10 * LATENCY_HALF_LIFE
+    assert router.per_image_estimate('full') == pytest.approx(0.1, rel=0.02)
+    assert run(router, 1, 0.5, 0.1) == 'full'
+    assert router.stats()['rejected'] == 1
+
+
+def test_decay_without_a_seed_floor_still_readmits(clock):
+    router = DeadlineRouter(('full',))
+    run(router, 1, None, 2.0)
+    assert router.admit(1, 0.5).tier is None
+    clock[0] += 3 * LATENCY_HALF_LIFE
+    assert router.admit(1, 0.5).tier == 'full'
+
+
+def test_full_falls_back_to_light_then_rejects(clock):
+    router = DeadlineRouter(('full', 'light'))
+    router.seed('full', 0.4)
+    router.seed('light', 0.1)
+    assert router.admit(2, 1.0).tier == 'full'
+    router = DeadlineRouter(('full', 'light'))
+    router.seed('full', 0.4)
+    router.seed('light', 0.1)
+    assert router.admit(2, 0.5).tier == 'light'
+    assert router.admit(2, 0.1).tier is None
+
+
+def test_serial_router_charges_the_backlog(clock):
+    router = DeadlineRouter(('full',), serial=True)
+    router.seed('full', 0.2)
+    assert router.admit(1, 1.0).tier == 'full'
+    assert router.admit(5, 1.0).tier is None
+
+
+def test_batched_router_does_not_charge_the_backlog(clock):
+    router = DeadlineRouter(('full',), serial=False)
+    router.seed('full', 0.2)
+    tickets = [router.admit(1, 1.0) for _ in range(20)]
+    assert all(ticket.tier == 'full' for ticket in tickets)
+    assert router.stats()['backlog_ms'] == pytest.approx(4000.0)
+
+
+def test_cancel_and_finish_release_the_backlog(clock):
+    router = DeadlineRouter(('full',))
+    router.seed('full', 0.2)
+    first = router.admit(1, None)
+    second = router.admit(1, None)
+    router.cancel(first)
+    router.start(second)
+    router.finish(second, 0.2)
+    stats = router.stats()
+    assert stats['backlog_ms'] == 0.0
+    assert stats['in_flight'] == 0
+    assert stats['served'] == {'full': 1}
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+class FakeBackend:
+    """Returns each row's first pixel as its embedding and records batch sizes"""
+    name = 'fake'
+    model = None
+    version = 'fake-v1'
+    input_size = (2, 2)
+
+    def __init__(self, fail_on=None):
+        self.batch_sizes = []
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+
+    def predict(self, img_batch):
+        with self.lock:
+            self.batch_sizes.append(len(img_batch))
+        if self.fail_on is not None and (img_batch[:, 0, 0, 0] == self.fail_on).any():
+            raise RuntimeError("inference failed")
+        return img_batch[:, 0, 0, :1].copy()
+
+
+def images(*values):
+    return np.stack([np.full((2, 2, 3), value, dtype=np.float32) for value in values])
+
+
+def predict_concurrently(batcher, batches):
+    with ThreadPoolExecutor(len(batches)) as pool:
+        return list(pool.map(batcher.predict, batches))
+
+
+def test_concurrent_callers_share_a_batch_and_get_their_own_rows():
+    backend = FakeBackend()
+    batcher = MicroBatcher(backend, max_batch_size=4, max_wait_ms=500)
+    results = predict_concurrently(batcher, [images(1), images(2, 3), images(4)])
+    assert [result[:, 0].tolist() for result in results] == [[1], [2, 3], [4]]
+    assert backend.batch_sizes == [4]
+    assert batcher.stats()["batches"] == 1
+    assert batcher.stats()["largest_batch"] == 4
+
+
+def test_batches_never_exceed_the_maximum():
+    backend = FakeBackend()
+    batcher = MicroBatcher(backend, max_batch_size=3, max_wait_ms=50)
+    results = predict_concurrently(batcher, [images(value) for value in range(7)])
+    assert [float(result[0, 0]) for result in results] == list(range(7))
+    assert max(backend.batch_sizes) <= 3
+    assert sum(backend.batch_sizes) == 7
+
+
+def test_request_larger_than_the_maximum_runs_alone():
+    backend = FakeBackend()
+    batcher = MicroBatcher(backend, max_batch_size=2, max_wait_ms=1)
+    assert batcher.predict(images(1, 2, 3))[:, 0].tolist() == [1, 2, 3]
+    assert backend.batch_sizes == [3]
+
+
+def test_failure_reaches_every_caller_in_the_batch_and_the_next_batch_runs():
+    backend = FakeBackend(fail_on=9)
+    batcher = MicroBatcher(backend, max_batch_size=2, max_wait_ms=500)
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(batcher.predict, images(value)) for value in (9, 1)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="inference failed"):
+                future.result()
+    assert batcher.predict(images(5))[:, 0].tolist() == [5]
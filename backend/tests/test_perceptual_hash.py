@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+from perceptual_hash import HASH_SIZE, PerceptualIndex, image_hash
+
+
+def photo(seed, size=299):
+    """Smooth random texture that survives re-encoding like a photo does"""
+    small = np.random.default_rng(seed).integers(0, 256, (size // 16, size // 16, 3), dtype=np.uint8)
+    return cv2.resize(small, (size, size), interpolation=cv2.INTER_CUBIC)
+
+
+def reencoded(img, quality=70, scale=0.8):
+    """The same image after a phone re-compresses and rescales it"""
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    decoded = cv2.imdecode(cv2.imencode('.jpg', small, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_COLOR)
+    return cv2.resize(decoded, img.shape[1::-1])
+
+
+def test_hash_is_two_packed_64_bit_hashes():
+    value = image_hash(photo(0))
+    assert value.dtype == np.uint8
+    assert value.shape == (2 * HASH_SIZE,)
+
+
+def test_reencoded_copy_matches_and_other_images_do_not():
+    index = PerceptualIndex()
+    index.add(image_hash(photo(0)), 'embedding-0', scope='user-a')
+    index.add(image_hash(photo(1)), 'embedding-1', scope='user-a')
+    assert index.lookup(image_hash(reencoded(photo(0))), scope='user-a') == 'embedding-0'
+    assert index.lookup(image_hash(photo(2)), scope='user-a') is None
+    assert index.stats()["hits"] == 1
+    assert index.stats()["misses"] == 1
+
+
+def test_matches_never_cross_scopes():
+    index = PerceptualIndex()
+    value = image_hash(photo(0))
+    index.add(value, 'embedding-a', scope='user-a')
+    assert index.lookup(value, scope='user-b') is None
+    assert index.lookup(value) is None
+    index.add(value, 'embedding-b', scope='user-b')
+    assert index.lookup(value, scope='user-b') == 'embedding-b'
+    assert index.lookup(value, scope='user-a') == 'embedding-a'
+
+
+def test_both_hashes_must_be_within_the_distance():
+    index = PerceptualIndex(max_distance=3)
+    value = image_hash(photo(0))
+    index.add(value, 'embedding', scope='s')
+    flipped = value.copy()
+    flipped[HASH_SIZE] ^= 0b1111  # 4 bits of the pHash half only
+    assert index.lookup(flipped, scope='s') is None
+    flipped[HASH_SIZE] ^= 0b1000  # back to 3 differing bits
+    assert index.lookup(flipped, scope='s') == 'embedding'
+
+
+def test_oldest_entries_are_replaced_when_full():
+    index = PerceptualIndex(max_entries=2)
+    hashes = [image_hash(photo(seed)) for seed in range(3)]
+    for seed, value in enumerate(hashes):
+        index.add(value, seed, scope='s')
+    assert index.stats()["entries"] == 2
+    assert index.lookup(hashes[0], scope='s') is None
+    assert [index.lookup(value, scope='s') for value in hashes[1:]] == [1, 2]
+
+
+def test_zero_size_index_stores_nothing():
+    index = PerceptualIndex(max_entries=0)
+    value = image_hash(photo(0))
+    index.add(value, 'embedding')
+    assert index.lookup(value) is None
@@ -2,6 +2,17 @@ const { spawn } = require('child_process');
 const path = require('path');
 const fs = require('fs');
 
+/**
+ * Add the camelCase score fields the controllers read to a raw Python result
+ * @param {Object} result - Python result with match_score / is_verified
+ * @returns {Object} The same result with matchScore and isVerified
+ */
+const toVerificationResult = (result) => ({
+    ...result,
+    matchScore: result.match_score,
+    isVerified: result.is_verified
+});
+
 /**
  * Call Python face verification script
  * @param {Buffer} govIdBuffer - Government ID image buffer
@@ -61,7 +72,7 @@ const verifyFacesWithPython = async (govIdBuffer, selfieBuffer) => {
                 
                 try {
                     const result = JSON.parse(stdout);
-                    resolve(result);
+                    resolve(toVerificationResult(result));
                 } catch (parseError) {
                     reject(new Error(`Failed to parse Python output: ${parseError.message}. Output: ${stdout}`));
                 }
@@ -93,98 +104,244 @@ const verifyFacesWithPython = async (govIdBuffer, selfieBuffer) => {
     });
 };
 
+const FRAME_MAGIC = Buffer.from('FVB1', 'ascii');
+
+const uint32 = (value) => {
+    const buffer = Buffer.alloc(4);
+    buffer.writeUInt32BE(value, 0);
+    return buffer;
+};
+
+/**
+ * Encode a framed binary request for face_verification_consistent.py --stdin
+ * @param {Object} header - JSON header; `images` lists the frame names in order
+ * @param {Buffer[]} images - Raw image buffers, in the order of header.images
+ * @returns {Buffer} Encoded request
+ */
+const encodeFramedRequest = (header, images) => {
+    const headerBuffer = Buffer.from(JSON.stringify(header), 'utf8');
+    const parts = [FRAME_MAGIC, uint32(headerBuffer.length), headerBuffer];
+    for (const imageBuffer of images) {
+        parts.push(uint32(imageBuffer.length), imageBuffer);
+    }
+    return Buffer.concat(parts);
+};
+
+/**
+ * Decode the first framed JSON response from Python stdout
+ * @param {Buffer} output - Raw stdout bytes
+ * @returns {Object} Parsed result
+ */
+const decodeFramedResponse = (output) => {
+    if (output.length < 8 || !output.subarray(0, 4).equals(FRAME_MAGIC)) {
+        throw new Error(`Invalid response frame: ${output.toString('utf8', 0, 200)}`);
+    }
+    const length = output.readUInt32BE(4);
+    if (output.length < 8 + length) {
+        throw new Error(`Truncated response frame (${output.length - 8} of ${length} bytes)`);
+    }
+    return JSON.parse(output.toString('utf8', 8, 8 + length));
+};
+
 /**
- * Alternative method: Send base64 encoded images directly to Python
+ * Alternative method: Stream raw image bytes to Python over stdin.
+ * Uses the framed binary protocol (framed_protocol.py), so no temp files are
+ * written and image size is not limited by argv.
  * @param {Buffer} govIdBuffer - Government ID image buffer
  * @param {Buffer} selfieBuffer - Selfie image buffer
  * @returns {Promise<Object>} Verification result
  */
 const verifyFacesWithPythonBase64 = async (govIdBuffer, selfieBuffer) => {
     return new Promise((resolve, reject) => {
-        // Create temporary file paths
-        const timestamp = Date.now();
-        const govIdPath = path.join(__dirname, `../temp/gov-id-b64-${timestamp}.jpg`);
-        const selfiePath = path.join(__dirname, `../temp/selfie-b64-${timestamp}.jpg`);
+        // Path to Python script (use consistent version)
+        const pythonScript = path.join(__dirname, '../face_verification_consistent.py');
         
-        // Ensure temp directory exists
-        const tempDir = path.join(__dirname, '../temp');
-        if (!fs.existsSync(tempDir)) {
-            fs.mkdirSync(tempDir, { recursive: true });
-        }
+        // Spawn Python process
+        const pythonProcess = spawn('python', [pythonScript, '--stdin']);
         
-        try {
-            // Write buffers to temporary files
-            fs.writeFileSync(govIdPath, govIdBuffer);
-            fs.writeFileSync(selfiePath, selfieBuffer);
-            
-            // Path to Python script (use consistent version)
-            const pythonScript = path.join(__dirname, '../face_verification_consistent.py');
-            
-            // Spawn Python process
-            const pythonProcess = spawn('python', [pythonScript, govIdPath, selfiePath]);
-            
-            let stdout = '';
-            let stderr = '';
-            
-            pythonProcess.stdout.on('data', (data) => {
-                stdout += data.toString();
-            });
-            
-            pythonProcess.stderr.on('data', (data) => {
-                stderr += data.toString();
-            });
-            
-            pythonProcess.on('close', (code) => {
-                // Clean up temporary files
-                try {
-                    if (fs.existsSync(govIdPath)) fs.unlinkSync(govIdPath);
-                    if (fs.existsSync(selfiePath)) fs.unlinkSync(selfiePath);
-                } catch (cleanupError) {
-                    console.warn('Warning: Could not clean up temporary files:', cleanupError);
-                }
-                
-                if (code !== 0) {
-                    console.error('Python script exited with code:', code);
-                    console.error('stderr:', stderr);
-                    reject(new Error(`Python face verification failed: ${stderr}`));
-                    return;
-                }
-                
-                try {
-                    const result = JSON.parse(stdout);
-                    resolve(result);
-                } catch (parseError) {
-                    reject(new Error(`Failed to parse Python output: ${parseError.message}. Output: ${stdout}`));
-                }
-            });
-            
-            pythonProcess.on('error', (error) => {
-                // Clean up on error
-                try {
-                    if (fs.existsSync(govIdPath)) fs.unlinkSync(govIdPath);
-                    if (fs.existsSync(selfiePath)) fs.unlinkSync(selfiePath);
-                } catch (cleanupError) {
-                    console.warn('Warning: Could not clean up temporary files:', cleanupError);
-                }
-                
-                reject(new Error(`Failed to spawn Python process: ${error.message}`));
-            });
+        const stdoutChunks = [];
+        let stderr = '';
+        
+        pythonProcess.stdout.on('data', (data) => {
+            stdoutChunks.push(data);
+        });
+        
+        pythonProcess.stderr.on('data', (data) => {
+            stderr += data.toString();
+        });
+        
+        pythonProcess.on('close', (code) => {
+            if (code !== 0) {
+                console.error('Python script exited with code:', code);
+                console.error('stderr:', stderr);
+                reject(new Error(`Python face verification failed: ${stderr}`));
+                return;
+            }
             
-        } catch (error) {
-            // Clean up on error
             try {
-                if (fs.existsSync(govIdPath)) fs.unlinkSync(govIdPath);
-                if (fs.existsSync(selfiePath)) fs.unlinkSync(selfiePath);
-            } catch (cleanupError) {
-                console.warn('Warning: Could not clean up temporary files:', cleanupError);
+                resolve(toVerificationResult(decodeFramedResponse(Buffer.concat(stdoutChunks))));
+            } catch (parseError) {
+                reject(new Error(`Failed to parse Python output: ${parseError.message}`));
+            }
+        });
+        
+        pythonProcess.on('error', (error) => {
+            reject(new Error(`Failed to spawn Python process: ${error.message}`));
+        });
+        
+        pythonProcess.stdin.on('error', (error) => {
+            console.warn('Warning: Could not write images to Python process:', error.message);
+        });
+        
+        pythonProcess.stdin.end(encodeFramedRequest(
+            { op: 'verify', images: ['gov_id', 'selfie'] },
+            [govIdBuffer, selfieBuffer]
+        ));
+    });
+};
+
+/**
+ * Persistent Python face verification server (face_verification_server.py).
+ * The process is spawned once and reused, so the model is only loaded once.
+ */
+let serverProcess = null;
+let nextRequestId = 1;
+// id -> { resolve, reject, child, timer }; child is the server process the request was written to
+const pendingRequests = new Map();
+const SERVER_REQUEST_TIMEOUT_MS = Number(process.env.FACE_SERVER_TIMEOUT_MS) || 60000;
+
+const settlePendingRequest = (id) => {
+    const pending = pendingRequests.get(id);
+    if (pending) {
+        clearTimeout(pending.timer);
+        pendingRequests.delete(id);
+    }
+    return pending;
+};
+
+const rejectPendingRequests = (child, error) => {
+    for (const [id, pending] of pendingRequests) {
+        if (pending.child === child) {
+            settlePendingRequest(id);
+            pending.reject(error);
+        }
+    }
+};
+
+// A dead or failed server only takes down its own requests; a newer one keeps running
+const serverStopped = (child, error) => {
+    if (serverProcess === child) {
+        serverProcess = null;
+    }
+    rejectPendingRequests(child, error);
+};
+
+const getServerProcess = () => {
+    if (serverProcess) {
+        return serverProcess;
+    }
+
+    const serverScript = path.join(__dirname, '../face_verification_server.py');
+    // Extra server flags, e.g. FACE_SERVER_ARGS="--precompute-uploads"
+    const serverArgs = (process.env.FACE_SERVER_ARGS || '').split(/\s+/).filter(Boolean);
+    const child = spawn('python', [serverScript, ...serverArgs], { cwd: path.join(__dirname, '..') });
+    serverProcess = child;
+    let buffer = '';
+
+    child.stdout.on('data', (data) => {
+        buffer += data.toString();
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf('\n')) !== -1) {
+            const line = buffer.slice(0, newlineIndex).trim();
+            buffer = buffer.slice(newlineIndex + 1);
+            if (!line) continue;
+
+            let response;
+            try {
+                response = JSON.parse(line);
+            } catch (parseError) {
+                console.warn('Warning: Could not parse Python server output:', line);
+                continue;
+            }
+
+            const pending = pendingRequests.get(response.id);
+            if (pending && pending.child === child) {
+                settlePendingRequest(response.id);
+                delete response.id;
+                pending.resolve(response);
             }
-            
-            reject(new Error(`Failed to prepare files for Python verification: ${error.message}`));
         }
     });
+
+    child.stderr.on('data', (data) => {
+        console.error('Python face verification server:', data.toString());
+    });
+
+    // Writing to a server that just died raises EPIPE here; unhandled, it would crash Node
+    child.stdin.on('error', (error) => {
+        serverStopped(child, new Error(`Python face verification server stopped accepting requests: ${error.message}`));
+    });
+
+    child.on('close', (code) => {
+        serverStopped(child, new Error(`Python face verification server exited with code ${code}`));
+    });
+
+    child.on('error', (error) => {
+        serverStopped(child, new Error(`Failed to spawn Python server: ${error.message}`));
+    });
+
+    return child;
+};
+
+const sendServerRequest = (request, timeoutMs = SERVER_REQUEST_TIMEOUT_MS) => {
+    return new Promise((resolve, reject) => {
+        const id = nextRequestId++;
+        try {
+            const child = getServerProcess();
+            const timer = setTimeout(() => {
+                if (settlePendingRequest(id)) {
+                    reject(new Error(`Python face verification server did not answer within ${timeoutMs} ms`));
+                }
+            }, timeoutMs);
+            pendingRequests.set(id, { resolve, reject, child, timer });
+            child.stdin.write(JSON.stringify({ ...request, id }) + '\n');
+        } catch (error) {
+            settlePendingRequest(id);
+            reject(new Error(`Failed to send request to Python server: ${error.message}`));
+        }
+    });
+};
+
+/**
+ * Verify faces using the persistent Python server
+ * @param {string} govIdPath - Path to the government ID image on disk
+ * @param {string} selfiePath - Path to the selfie image on disk
+ * @param {Object} [options]
+ * @param {number} [options.deadlineMs] - Latency budget; defaults to FACE_VERIFICATION_DEADLINE_MS
+ * @returns {Promise<Object>} Verification result
+ */
+const verifyFacesWithPythonServer = async (govIdPath, selfiePath, options = {}) => {
+    const deadlineMs = options.deadlineMs ?? (Number(process.env.FACE_VERIFICATION_DEADLINE_MS) || undefined);
+    const result = await sendServerRequest({
+        op: 'verify',
+        gov_id: path.resolve(govIdPath),
+        selfie: path.resolve(selfiePath),
+        ...(deadlineMs ? { deadline_ms: deadlineMs } : {})
+    });
+    return toVerificationResult(result);
+};
+
+/**
+ * Health check for the persistent Python server
+ * @returns {Promise<Object>} Health status, including whether the model is ready
+ */
+const pythonServerHealth = async () => {
+    return sendServerRequest({ op: 'health' });
 };
 
 module.exports = {
     verifyFacesWithPython,
-    verifyFacesWithPythonBase64
-};
+    verifyFacesWithPythonBase64,
+    verifyFacesWithPythonServer,
+    pythonServerHealth
+};
\ No newline at end of file
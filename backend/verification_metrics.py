@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Hot-path instrumentation for the face verification engine.
+
+A Timings object collects per-stage durations and counters for one
+verification call; NULL_TIMINGS is a shared no-op used when instrumentation is
+off, so the disabled path costs one method call per stage. A MetricsRegistry
+aggregates the resulting `timings` blocks for a long-running engine and
+renders them in the Prometheus text exposition format.
+"""
+
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager, nullcontext
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def current_rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Fall back to the peak RSS where /proc is unavailable (KiB on Linux, bytes on macOS)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+
+class Timings:
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def merge(self, other):
+        """Fold in the stages and counters another thread recorded for the same call"""
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, value in other.counters.items():
+            self.add(name, value)
+
+    def as_dict(self):
+        """The `timings` block added to a result"""
+        block = {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+        block["total_ms"] = round((time.perf_counter() - self.started) * 1000, 3)
+        block.update(self.counters)
+        block["rss_mb"] = round(current_rss_bytes() / (1024 * 1024), 1)
+        return block
+
+
+class _NullTimings:
+    enabled = False
+    _null = nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def add(self, name, value=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+NULL_TIMINGS = _NullTimings()
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self, prefix='face_verification'):
+        """Aggregate Timings from many calls into Prometheus-style metrics"""
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.stage_seconds = {}
+        self.batch_size = _Histogram(BATCH_BUCKETS)
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds.setdefault(stage, _Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            key = (name, None)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record(self, block, operation):
+        """Aggregate one result's `timings` block (see Timings.as_dict)"""
+        with self._lock:
+            key = ('requests_total', operation)
+            self.counters[key] = self.counters.get(key, 0) + 1
+            for name, value in block.items():
+                if name.endswith('_ms'):
+                    stage = name[:-3]
+                    self.stage_seconds.setdefault(stage, _Histogram(LATENCY_BUCKETS)).observe(value / 1000)
+            for name in ('cache_hits', 'cache_misses', 'images'):
+                if name in block:
+                    key = (name + '_total', None)
+                    self.counters[key] = self.counters.get(key, 0) + block[name]
+            if 'batch_size' in block:
+                self.batch_size.observe(block['batch_size'])
+
+    def _render_histogram(self, lines, name, histogram, labels=''):
+        separator = ',' if labels else ''
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {histogram.total}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.total}')
+
+    def render(self, extra_gauges=None):
+        """Prometheus text exposition of everything recorded so far"""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            lines.append(f'# HELP {p}_stage_seconds Time spent per verification stage')
+            lines.append(f'# TYPE {p}_stage_seconds histogram')
+            for name, histogram in sorted(self.stage_seconds.items()):
+                self._render_histogram(lines, f'{p}_stage_seconds', histogram, f'stage="{name}"')
+
+            lines.append(f'# HELP {p}_batch_size Images per forward pass')
+            lines.append(f'# TYPE {p}_batch_size histogram')
+            self._render_histogram(lines, f'{p}_batch_size', self.batch_size)
+
+            counters = {}
+            for (name, operation), value in self.counters.items():
+                counters.setdefault(name, []).append((operation, value))
+            for name, values in sorted(counters.items()):
+                lines.append(f'# TYPE {p}_{name} counter')
+                for operation, value in sorted(values, key=lambda item: item[0] or ''):
+                    labels = f'{{operation="{operation}"}}' if operation else ''
+                    lines.append(f'{p}_{name}{labels} {value}')
+
+        gauges = {'resident_memory_bytes': current_rss_bytes()}
+        gauges.update(extra_gauges or {})
+        for name, value in gauges.items():
+            lines.append(f'# TYPE {p}_{name} gauge')
+            lines.append(f'{p}_{name} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, extra_gauges=None):
+        """Atomically write the metrics for a node_exporter textfile collector"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render(extra_gauges))
+        os.replace(tmp_path, path)
+
+
+METRICS = MetricsRegistry()